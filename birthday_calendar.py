@@ -0,0 +1,109 @@
+# birthday_calendar.py
+import calendar
+import datetime as dt
+
+# Every valid 'MM-DD' birthday maps to a slot: its 0-based day of a leap year (0..365).
+# Tables are built once at import so sorting, matching and formatting are plain lookups.
+SLOT_COUNT = 366
+_LEAP_DAYS_IN_MONTH = [0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# LEAP_DAY_OF_YEAR[month][day] / COMMON_DAY_OF_YEAR[month][day] -> 0-based day of the year the
+# birthday is celebrated on. In common years Feb 29 is celebrated on Feb 28.
+LEAP_DAY_OF_YEAR: list[list[int]] = [[]]
+COMMON_DAY_OF_YEAR: list[list[int]] = [[]]
+
+# SLOT_MONTH_DAY[slot] -> (month, day); SLOT_DISPLAY[slot] -> e.g. "29th February"
+SLOT_MONTH_DAY: list[tuple[int, int]] = []
+SLOT_DISPLAY: list[str] = []
+_SLOT_BY_STRING: dict[str, int] = {}
+
+
+def _ordinal_suffix(day: int) -> str:
+    if 4 <= day <= 20 or 24 <= day <= 30:
+        return "th"
+    return ["st", "nd", "rd"][(day % 10) - 1] if 1 <= day % 10 <= 3 else "th"
+
+
+def _build_tables():
+    leap_doy = common_doy = 0
+    for month in range(1, 13):
+        leap_row, common_row = [-1], [-1]
+        for day in range(1, _LEAP_DAYS_IN_MONTH[month] + 1):
+            leap_row.append(leap_doy)
+            if month == 2 and day == 29:
+                common_row.append(common_doy - 1)  # Same day as Feb 28
+            else:
+                common_row.append(common_doy)
+                common_doy += 1
+
+            SLOT_MONTH_DAY.append((month, day))
+            SLOT_DISPLAY.append(f"{day}{_ordinal_suffix(day)} {calendar.month_name[month]}")
+            _SLOT_BY_STRING[f"{month:02d}-{day:02d}"] = leap_doy
+            leap_doy += 1
+        LEAP_DAY_OF_YEAR.append(leap_row)
+        COMMON_DAY_OF_YEAR.append(common_row)
+
+
+_build_tables()
+
+
+def birthday_slot(birthday_str: str) -> int | None:
+    """Slot (0..365) of an 'MM-DD' birthday, or None if it isn't a valid date."""
+    return _SLOT_BY_STRING.get(birthday_str)
+
+
+def date_slot(date: dt.date) -> int:
+    """Slot (0..365) of a calendar date's month and day."""
+    return LEAP_DAY_OF_YEAR[date.month][date.day]
+
+
+def slot_string(slot: int) -> str:
+    """The 'MM-DD' string for a slot."""
+    month, day = SLOT_MONTH_DAY[slot]
+    return f"{month:02d}-{day:02d}"
+
+
+def day_of_year(month: int, day: int, year: int) -> int:
+    """0-based day of `year` a birthday on month/day is celebrated on (Feb 29 -> Feb 28 in common years)."""
+    table = LEAP_DAY_OF_YEAR if calendar.isleap(year) else COMMON_DAY_OF_YEAR
+    return table[month][day]
+
+
+def is_celebrated_on(slot: int, date: dt.date) -> bool:
+    """Whether a birthday slot is celebrated on the given date."""
+    month, day = SLOT_MONTH_DAY[slot]
+    return day_of_year(month, day, date.year) == day_of_year(date.month, date.day, date.year)
+
+
+def display(birthday_str: str) -> str | None:
+    """Readable form of an 'MM-DD' birthday (e.g. '1st March'), or None if it isn't valid."""
+    slot = _SLOT_BY_STRING.get(birthday_str)
+    return SLOT_DISPLAY[slot] if slot is not None else None
+
+
+def upcoming_order(entries: list[tuple[int, str]], today: dt.date) -> list[tuple[int, str]]:
+    """
+    Order (user_id, 'MM-DD') entries by how soon they're celebrated, today first.
+
+    A bucket pass over the days of the year, so O(n) with no date objects built
+    per entry. Entries on the same day keep their input order; invalid
+    birthdays go last.
+    """
+    is_leap = calendar.isleap(today.year)
+    table = LEAP_DAY_OF_YEAR if is_leap else COMMON_DAY_OF_YEAR
+    year_length = 366 if is_leap else 365
+    today_doy = table[today.month][today.day]
+
+    buckets: list[list[tuple[int, str]]] = [[] for _ in range(year_length)]
+    invalid = []
+    for entry in entries:
+        slot = _SLOT_BY_STRING.get(entry[1])
+        if slot is None:
+            invalid.append(entry)
+            continue
+        month, day = SLOT_MONTH_DAY[slot]
+        buckets[(table[month][day] - today_doy) % year_length].append(entry)
+
+    ordered = [entry for bucket in buckets for entry in bucket]
+    ordered.extend(invalid)
+    return ordered
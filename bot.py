@@ -1,16 +1,24 @@
 import discord
 from discord.ext import commands
 import asyncio
+import hashlib
+import json
 import logging
-from config import BOT_TOKEN, GUILD_IDS, BIRTHDAY_INTERVAL_MINUTES, DB_FILE
+import time
+from config import BOT_TOKEN, GUILD_IDS, DB_FILE, PINNED_REFRESH_DEBOUNCE_SECONDS, FORCE_COMMAND_SYNC
 from database import Database
 from logger import logger
-from tasks import birthday_check_loop
+from tasks import birthday_check_loop, reconcile_stored_data
+from scheduler import BirthdayScheduler
+from utils import PinnedRefreshQueue, BirthdayPageButton
 
 # --- Intents ---
 intents = discord.Intents.default()
 intents.members = True  # Needed to access member info for birthdays
 
+# Only members with birthdays are cached (see utils.cache_birthday_members); guilds aren't chunked up front
+member_cache_flags = discord.MemberCacheFlags.none()
+
 # --- Cogs to Load ---
 COGS_TO_LOAD = [
     "cogs.birthdays",
@@ -24,9 +32,18 @@ COGS_TO_LOAD = [
 
 class BirthdayBot(commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix="!", intents=intents)
+        super().__init__(
+            command_prefix="!",
+            intents=intents,
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=False
+        )
         self.db = Database(DB_FILE)  # Single persistent DB instance
+        self.scheduler = BirthdayScheduler(self)
+        self.pinned_refresh = PinnedRefreshQueue(self, PINNED_REFRESH_DEBOUNCE_SECONDS)
         self.birthday_task = None
+        self.reconcile_task = None
+        self.sync_task = None
 
     async def setup_hook(self):
         """This runs once when the bot starts — perfect place for setup."""
@@ -37,33 +54,70 @@ class BirthdayBot(commands.Bot):
         await self.db.init_db()
         logger.info("✅ Database initialized.")
 
-        # 2. Load Cogs
+        # 2. Register persistent pinned-list page buttons (they survive restarts)
+        self.add_dynamic_items(BirthdayPageButton)
+
+        # 3. Load Cogs (timed, so slow extensions show up in the startup log)
+        cogs_started = time.perf_counter()
         for cog in COGS_TO_LOAD:
+            started = time.perf_counter()
             try:
                 await self.load_extension(cog)
-                logger.info(f"-> Loaded cog: {cog}")
+                logger.info(f"-> Loaded cog: {cog} ({(time.perf_counter() - started) * 1000:.1f} ms)")
             except Exception as e:
                 logger.error(f"-> Failed to load cog {cog}: {e}")
-        logger.info("✅ All cogs loaded.")
+        logger.info(f"✅ All cogs loaded in {(time.perf_counter() - cogs_started) * 1000:.1f} ms.")
+
+        # 4. Start Birthday Loop
+        self.start_birthday_loop()
 
-        # 3. Sync Slash Commands
+        # 5. Sync Slash Commands in the background, and only if the command tree changed
+        self.sync_task = asyncio.create_task(self.sync_startup_commands())
+
+        # 6. Clean up after members/guilds that left while we were offline (once every guild is ready)
+        self.reconcile_task = asyncio.create_task(self.run_startup_reconciliation())
+        logger.info("✅ Setup complete.")
+
+    # ---- Command Sync ----
+    def command_tree_hash(self, guild: discord.abc.Snowflake | None = None) -> str:
+        """SHA-256 of the command payload a sync would send for `guild` (or globally)."""
+        payload = [command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)]
+        payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+        serialized = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    async def sync_commands(self, guild: discord.abc.Snowflake | None = None, force: bool = False) -> bool:
+        """
+        Syncs application commands for `guild` (or globally) unless the tree's
+        hash matches the one stored at the last sync. Returns whether it synced.
+        """
+        key = f"command_tree_hash:{guild.id}" if guild else "command_tree_hash:global"
+        scope = (getattr(guild, "name", None) or f"guild {guild.id}") if guild else "global scope"
+        tree_hash = self.command_tree_hash(guild)
+        if not force and await self.db.get_config_value(key) == tree_hash:
+            logger.info(f"🌐 Commands unchanged for {scope}, skipping sync.")
+            return False
+
+        started = time.perf_counter()
+        await self.tree.sync(guild=guild)
+        await self.db.set_config_value(key, tree_hash)
+        logger.info(
+            f"🌐 Synced commands for {scope} "
+            f"in {(time.perf_counter() - started) * 1000:.0f} ms."
+        )
+        return True
+
+    async def sync_startup_commands(self):
+        """Startup sync for GUILD_IDS (or globally), forced by FORCE_COMMAND_SYNC."""
         try:
             if GUILD_IDS:
                 for guild_id in GUILD_IDS:
-                    guild = self.get_guild(guild_id)
-                    if guild:
-                        await self.tree.sync(guild=guild)
-                        logger.info(f"🌐 Synced commands for guild: {guild.name}")
+                    await self.sync_commands(discord.Object(id=guild_id), force=FORCE_COMMAND_SYNC)
             else:
-                await self.tree.sync()
-                logger.info("🌐 Synced commands globally.")
+                await self.sync_commands(force=FORCE_COMMAND_SYNC)
         except Exception as e:
             logger.error(f"Error syncing commands: {e}", exc_info=True)
 
-        # 4. Start Birthday Loop
-        self.start_birthday_loop()
-        logger.info("✅ Setup complete.")
-
     def start_birthday_loop(self):
         """Starts the birthday check background task."""
         if self.birthday_task is None or self.birthday_task.done():
@@ -73,15 +127,22 @@ class BirthdayBot(commands.Bot):
     async def safe_birthday_loop(self):
         """Wrapper for the birthday loop that restarts it on crash."""
         await self.wait_until_ready()
-        await asyncio.sleep(2)  # Allow member cache to populate
         while not self.is_closed():
             try:
-                await birthday_check_loop(self, interval_minutes=BIRTHDAY_INTERVAL_MINUTES)
+                await birthday_check_loop(self)
             except Exception as e:
                 logger.error(f"❌ Birthday check loop crashed: {e}", exc_info=True)
                 logger.info("🔁 Restarting birthday check loop in 60 seconds...")
                 await asyncio.sleep(60)
 
+    async def run_startup_reconciliation(self):
+        """Runs the one-off reconciliation sweep once connected."""
+        await self.wait_until_ready()
+        try:
+            await reconcile_stored_data(self)
+        except Exception as e:
+            logger.error(f"❌ Startup reconciliation failed: {e}", exc_info=True)
+
     async def close(self):
         """Ensure DB is closed properly when the bot shuts down."""
         logger.info("🔌 Shutting down bot, closing database connection...")
@@ -96,6 +157,14 @@ class BirthdayBot(commands.Bot):
         logger.info(f"🎉 Serving guilds: {guild_names if guild_names else 'No guilds connected'}")
         logger.info("=" * 50)
 
+    async def on_guild_join(self, guild: discord.Guild):
+        logger.info(f"➕ Joined guild {guild.name} ({guild.id})")
+        await self.scheduler.schedule_guild(guild.id)
+
+    async def on_guild_remove(self, guild: discord.Guild):
+        logger.info(f"➖ Removed from guild {guild.name} ({guild.id})")
+        self.scheduler.forget_guild(guild.id)
+
     async def on_connect(self):
         logger.info("🔌 Connected to Discord Gateway.")
 
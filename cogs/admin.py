@@ -5,29 +5,147 @@ from discord.ui import View, Button
 from utils import (
     parse_day_month_input,
     format_birthday_display,
-    update_pinned_birthday_message,
-    is_birthday_on_date,
+    cache_birthday_members,
     ensure_setup  # ✅ Use centralized version
 )
 from logger import logger
-import datetime as dt
+import csv
+import io
+import json
+from typing import Iterable, Iterator
 
 BOT_BIRTHDAY = 9  # September 9th, for fun message
+IMPORT_CHUNK_SIZE = 500  # Rows per transaction (and per progress update) when importing
+MAX_IMPORT_FILE_BYTES = 5 * 1024 * 1024
 
 # ---------------- Admin/Mod Utilities ----------------
-def is_admin_or_mod(member: discord.Member, mod_role_id: int | str | None = None) -> bool:
+def is_admin_or_mod(member: discord.Member, mod_role_id: int | None = None) -> bool:
     """Check if a member has administrator permissions or the configured moderator role."""
     if member.guild_permissions.administrator:
         return True
     if mod_role_id:
-        try:
-            mod_role_id = int(mod_role_id)
-        except (TypeError, ValueError):
-            return False
         return any(role.id == mod_role_id for role in member.roles)
     return False
 
 
+# ---------------- Import Parsing ----------------
+def parse_import_user(user_part) -> int | None:
+    """Parse a user mention (<@123>, <@!123>) or raw ID."""
+    user_part = str(user_part).strip()
+    if user_part.startswith("<@") and user_part.endswith(">"):
+        user_part = user_part.replace("<@", "").replace("!", "").replace(">", "")
+    try:
+        return int(user_part)
+    except ValueError:
+        return None
+
+
+def parse_import_date(*date_parts) -> str | None:
+    """Parse 'DD/MM', 'DD MM' or separate day and month values into a valid 'MM-DD' birthday."""
+    parts = " ".join(str(part) for part in date_parts).replace("/", " ").split()
+    if len(parts) != 2:
+        return None
+    result = parse_day_month_input(*parts)
+    if not result:
+        return None
+    day, month = result
+    return f"{month:02d}-{day:02d}"
+
+
+def iter_import_lines(lines: Iterable[str], stats: dict) -> Iterator[tuple[int, str]]:
+    """Yield (user_id, 'MM-DD') from 'user - DD/MM' lines, counting unusable lines in stats['rejected']."""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        user_part, sep, date_part = line.partition("-")
+        user_id = parse_import_user(user_part) if sep else None
+        birthday_str = parse_import_date(date_part) if user_id else None
+        if birthday_str is None:
+            stats["rejected"] += 1
+            continue
+        yield user_id, birthday_str
+
+
+def iter_import_csv(lines: Iterable[str], stats: dict) -> Iterator[tuple[int, str]]:
+    """Yield (user_id, 'MM-DD') from CSV rows of user,date or user,day,month (a header row is skipped)."""
+    for row_number, row in enumerate(csv.reader(lines)):
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        user_id = parse_import_user(row[0])
+        birthday_str = parse_import_date(*row[1:3]) if user_id and len(row) >= 2 else None
+        if birthday_str is None:
+            if row_number == 0 and user_id is None:
+                continue  # Header
+            stats["rejected"] += 1
+            continue
+        yield user_id, birthday_str
+
+
+def _json_entry(entry) -> tuple:
+    """(user, date) parts of a JSON object with "user"/"user_id" and "date" (or "day" and "month")."""
+    if not isinstance(entry, dict):
+        return None, None
+    return entry.get("user_id", entry.get("user")), entry.get("date") or f"{entry.get('day')} {entry.get('month')}"
+
+
+def _iter_json_items(items: Iterable[tuple], stats: dict) -> Iterator[tuple[int, str]]:
+    for user_part, date_part in items:
+        user_id = parse_import_user(user_part) if user_part is not None else None
+        birthday_str = parse_import_date(date_part) if user_id and date_part else None
+        if birthday_str is None:
+            stats["rejected"] += 1
+            continue
+        yield user_id, birthday_str
+
+
+def iter_import_json(data: bytes, stats: dict) -> Iterator[tuple[int, str]]:
+    """
+    Yield (user_id, 'MM-DD') from JSON: either {"<user>": "DD/MM", ...} or a list of
+    objects with "user"/"user_id" and "date" (or "day" and "month").
+
+    The document is parsed whole (it's capped at MAX_IMPORT_FILE_BYTES); use
+    JSON Lines for files that should be read row by row.
+    """
+    try:
+        payload = json.loads(data)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON ({e.msg} at line {e.lineno})") from e
+
+    if isinstance(payload, dict):
+        return _iter_json_items(payload.items(), stats)
+    if isinstance(payload, list):
+        return _iter_json_items(map(_json_entry, payload), stats)
+    raise ValueError("expected a JSON object or list")
+
+
+def iter_import_json_lines(lines: Iterable[str], stats: dict) -> Iterator[tuple[int, str]]:
+    """Yield (user_id, 'MM-DD') from JSON Lines, one object per line (same keys as the JSON list form)."""
+    def entries():
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield _json_entry(json.loads(line))
+            except json.JSONDecodeError:
+                yield None, None
+
+    return _iter_json_items(entries(), stats)
+
+
+def iter_import_file(filename: str, data: bytes, stats: dict) -> Iterator[tuple[int, str]]:
+    """Pick a parser from the file extension; anything else is read as 'user - DD/MM' lines."""
+    if filename.lower().endswith(".json"):
+        return iter_import_json(data, stats)
+    # Decoded lazily line by line, so rows reach the DB in chunks as they're parsed
+    lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline="")
+    if filename.lower().endswith((".jsonl", ".ndjson")):
+        return iter_import_json_lines(lines, stats)
+    if filename.lower().endswith(".csv"):
+        return iter_import_csv(lines, stats)
+    return iter_import_lines(lines, stats)
+
+
 # ---------------- Admin Cog ----------------
 class Admin(commands.Cog):
     def __init__(self, bot):
@@ -65,18 +183,9 @@ class Admin(commands.Cog):
         birthday_str = f"{month:02d}-{day:02d}"
 
         try:
-            await self.bot.db.set_birthday(interaction.guild.id, user.id, birthday_str)
-            # Update pinned birthday message
-            all_birthdays = await self.bot.db.get_birthdays(interaction.guild.id)
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [uid for uid, bday in all_birthdays if is_birthday_on_date(bday, today)]
-            pinned_msg = await update_pinned_birthday_message(interaction.guild, db=self.bot.db, highlight_today=birthdays_today)
-
-            if pinned_msg and not pinned_msg.pinned:
-                try:
-                    await pinned_msg.pin()
-                except discord.Forbidden:
-                    logger.warning(f"Cannot pin birthday message in {interaction.guild.name}")
+            await self.bot.db.set_birthday(interaction.guild.id, user.id, birthday_str, display_name=user.display_name)
+            # Pinned birthday message is refreshed in the background
+            self.bot.pinned_refresh.mark_dirty(interaction.guild)
 
         except Exception as e:
             logger.error(f"Error setting birthday: {e}", exc_info=True)
@@ -101,10 +210,7 @@ class Admin(commands.Cog):
         await interaction.response.defer(ephemeral=True)
         try:
             await self.bot.db.delete_birthday(interaction.guild.id, user.id)
-            all_birthdays = await self.bot.db.get_birthdays(interaction.guild.id)
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [uid for uid, bday in all_birthdays if is_birthday_on_date(bday, today)]
-            await update_pinned_birthday_message(interaction.guild, db=self.bot.db, highlight_today=birthdays_today)
+            self.bot.pinned_refresh.mark_dirty(interaction.guild)
 
         except Exception as e:
             logger.error(f"Error deleting birthday: {e}", exc_info=True)
@@ -114,9 +220,20 @@ class Admin(commands.Cog):
         await interaction.followup.send(f"🗑️ {user.display_name}'s birthday has been deleted.", ephemeral=True)
 
     # ---------------- Import Birthdays ----------------
-    @app_commands.command(name="importbirthdays", description="Import birthdays from a message (Admin/Mod)")
+    @app_commands.command(name="importbirthdays", description="Import birthdays from a message or a CSV/JSON/JSONL file (Admin/Mod)")
     @app_commands.default_permissions(manage_guild=True)
-    async def importbirthdays(self, interaction: "discord.Interaction", channel: discord.TextChannel, message_id: str):
+    @app_commands.describe(
+        channel="Channel of the message to import from",
+        message_id="ID of the message to import from",
+        file="CSV (user,date or user,day,month), JSON or JSON Lines file to import from"
+    )
+    async def importbirthdays(
+        self,
+        interaction: "discord.Interaction",
+        channel: discord.TextChannel = None,
+        message_id: str = None,
+        file: discord.Attachment = None
+    ):
         if not await ensure_setup(interaction, self.bot.db):
             return
 
@@ -125,52 +242,86 @@ class Admin(commands.Cog):
             await interaction.response.send_message("❗ You are not allowed to use this.", ephemeral=True)
             return
 
+        if file is None and (channel is None or message_id is None):
+            await interaction.response.send_message(
+                "❗ Give me either a `file`, or a `channel` and `message_id` to import from.", ephemeral=True
+            )
+            return
+        if file is None and not message_id.strip().isdigit():
+            await interaction.response.send_message("❗ That isn't a valid message ID.", ephemeral=True)
+            return
+        if file is not None and file.size > MAX_IMPORT_FILE_BYTES:
+            await interaction.response.send_message(
+                f"❗ That file is too big (max {MAX_IMPORT_FILE_BYTES // (1024 * 1024)} MB).", ephemeral=True
+            )
+            return
+
         await interaction.response.defer(ephemeral=True)
-        updated_count = 0
+        stats = {"rejected": 0, "written": 0}
+        progress_msg = None
 
-        try:
-            msg = await channel.fetch_message(int(message_id))
-            lines = msg.content.splitlines()
-            for line in lines:
-                line = line.strip()
-                if not line or "-" not in line:
-                    continue
+        async def report(content: str):
+            # Overwrite the progress message so it doesn't stay on "Importing..." after a failure
+            if progress_msg is not None:
+                await progress_msg.edit(content=content)
+            else:
+                await interaction.followup.send(content, ephemeral=True)
 
+        try:
+            if file is not None:
+                # The attachment (at most MAX_IMPORT_FILE_BYTES) is held in memory; rows are parsed from it lazily
+                data = await file.read()
                 try:
-                    user_part, date_part = line.split("-", 1)
-                    user_part, date_part = user_part.strip(), date_part.strip()
-                except ValueError:
-                    continue
+                    rows = iter_import_file(file.filename, data, stats)
+                except ValueError as e:
+                    await report(f"❗ Could not read that file: {e}")
+                    return
+            else:
+                msg = await channel.fetch_message(int(message_id))
+                rows = iter_import_lines(msg.content.splitlines(), stats)
 
-                try:
-                    if user_part.startswith("<@") and user_part.endswith(">"):
-                        user_id = int(user_part.replace("<@", "").replace("!", "").replace(">", ""))
-                    else:
-                        user_id = int(user_part)
-                except ValueError:
-                    continue
-
-                result = parse_day_month_input(*date_part.replace("/", " ").split())
-                if not result:
-                    continue
-                day, month = result
-                birthday_str = f"{month:02d}-{day:02d}"
-                await self.bot.db.set_birthday(interaction.guild.id, user_id, birthday_str)
-                updated_count += 1
-
-            # Update pinned birthday message
-            all_birthdays = await self.bot.db.get_birthdays(interaction.guild.id)
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [uid for uid, bday in all_birthdays if is_birthday_on_date(bday, today)]
-            await update_pinned_birthday_message(interaction.guild, db=self.bot.db, highlight_today=birthdays_today)
-
-            await interaction.followup.send(f"✅ Imported {updated_count} birthdays.", ephemeral=True)
+            progress_msg = await interaction.followup.send("⏳ Importing birthdays...", ephemeral=True, wait=True)
+
+            async def report_progress(written: int):
+                stats["written"] = written
+                await progress_msg.edit(content=f"⏳ Imported {written} birthdays so far ({stats['rejected']} rejected)...")
+
+            imported_ids = []
+
+            def track(rows):
+                for user_id, birthday_str in rows:
+                    imported_ids.append(user_id)
+                    yield user_id, birthday_str
+
+            updated_count = await self.bot.db.bulk_set_birthdays(
+                interaction.guild.id, track(rows), chunk_size=IMPORT_CHUNK_SIZE, progress=report_progress
+            )
+
+            # Load the imported members in batches so the list shows names (and bots are dropped)
+            await progress_msg.edit(content=f"⏳ Imported {updated_count} birthdays, loading member names...")
+            await cache_birthday_members(interaction.guild, self.bot.db, list(dict.fromkeys(imported_ids)))
+
+            # Pinned birthday message is refreshed in the background
+            self.bot.pinned_refresh.mark_dirty(interaction.guild)
+
+            logger.info(
+                f"📥 {interaction.user.display_name} imported {updated_count} birthdays "
+                f"({stats['rejected']} rejected) in {interaction.guild.name}"
+            )
+            await progress_msg.edit(
+                content=f"✅ Imported {updated_count} birthdays. {stats['rejected']} lines were rejected."
+            )
 
         except discord.NotFound:
-            await interaction.followup.send("🔍 Message not found or inaccessible.", ephemeral=True)
+            await report("🔍 Message not found or inaccessible.")
         except Exception as e:
             logger.error(f"Error importing birthdays: {e}", exc_info=True)
-            await interaction.followup.send("🚨 Error importing birthdays. Try again later.", ephemeral=True)
+            if stats["written"]:
+                # Earlier chunks are already committed, so the list can show them
+                self.bot.pinned_refresh.mark_dirty(interaction.guild)
+            await report(
+                f"🚨 Error importing birthdays after {stats['written']} were saved. Try again later."
+            )
 
     # ---------------- Clear All Birthdays with Confirmation ----------------
     @app_commands.command(
@@ -204,10 +355,11 @@ class Admin(commands.Cog):
                     content="🧹 Clearing all birthdays and resetting configuration...", view=None
                 )
                 try:
-                    await self.bot.db.db.execute("DELETE FROM birthdays WHERE guild_id = ?", (self.guild_id,))
-                    await self.bot.db.db.execute("DELETE FROM guild_config WHERE guild_id = ?", (self.guild_id,))
-                    await self.bot.db.db.execute("DELETE FROM wished_today WHERE guild_id = ?", (self.guild_id,))
-                    await self.bot.db.db.commit()
+                    await self.bot.db.clear_wished(self.guild_id)
+                    await self.bot.db.delete_guild_birthdays(self.guild_id)
+                    # Deletes the config row and evicts the cached config
+                    await self.bot.db.delete_guild_config(self.guild_id)
+                    self.bot.scheduler.unschedule_guild(self.guild_id)
 
                     logger.info(f"🧹 {interaction_button.user.display_name} cleared all birthdays/config in {interaction_button.guild.name}")
                     await interaction_button.followup.send(
@@ -4,7 +4,6 @@ from discord.ext import commands, tasks
 from utils import (
     parse_day_month_input,
     format_birthday_display,
-    update_pinned_birthday_message,
     is_birthday_on_date,
     ensure_setup  # ✅ Use centralized version
 )
@@ -26,18 +25,7 @@ class Birthdays(commands.Cog):
     async def refresh_pinned_messages(self):
         for guild in self.bot.guilds:
             try:
-                birthdays = await self.bot.db.get_birthdays(guild.id)
-                today = dt.datetime.now(dt.timezone.utc)
-                birthdays_today = [
-                    uid for uid, bday in birthdays 
-                    if is_birthday_on_date(bday, today)
-                    and (member := guild.get_member(uid)) and not member.bot
-                ]
-                await update_pinned_birthday_message(
-                    guild,
-                    db=self.bot.db,
-                    highlight_today=birthdays_today
-                )
+                await self.bot.pinned_refresh.refresh_now(guild, manual=True)
             except Exception as e:
                 logger.error(f"Failed daily pinned refresh in {guild.name}: {e}")
 
@@ -71,19 +59,10 @@ class Birthdays(commands.Cog):
         birthday_str = f"{month:02d}-{day:02d}"
 
         try:
-            await self.bot.db.set_birthday(interaction.guild.id, interaction.user.id, birthday_str)
-            all_birthdays = await self.bot.db.get_birthdays(interaction.guild.id)
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [
-                uid for uid, bday in all_birthdays 
-                if is_birthday_on_date(bday, today)
-                and (member := interaction.guild.get_member(uid)) and not member.bot
-            ]
-            await update_pinned_birthday_message(
-                interaction.guild,
-                db=self.bot.db,
-                highlight_today=birthdays_today
+            await self.bot.db.set_birthday(
+                interaction.guild.id, interaction.user.id, birthday_str, display_name=interaction.user.display_name
             )
+            self.bot.pinned_refresh.mark_dirty(interaction.guild)
         except Exception as e:
             logger.error(f"Error setting birthday for {interaction.user.display_name}: {e}")
             await interaction.followup.send("🚨 Failed to set birthday. Try again later.", ephemeral=True)
@@ -102,18 +81,7 @@ class Birthdays(commands.Cog):
 
         try:
             await self.bot.db.delete_birthday(interaction.guild.id, interaction.user.id)
-            all_birthdays = await self.bot.db.get_birthdays(interaction.guild.id)
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [
-                uid for uid, bday in all_birthdays 
-                if is_birthday_on_date(bday, today)
-                and (member := interaction.guild.get_member(uid)) and not member.bot
-            ]
-            await update_pinned_birthday_message(
-                interaction.guild,
-                db=self.bot.db,
-                highlight_today=birthdays_today
-            )
+            self.bot.pinned_refresh.mark_dirty(interaction.guild)
         except Exception as e:
             logger.error(f"Error deleting birthday for {interaction.user.display_name}: {e}")
             await interaction.followup.send("🚨 Failed to delete birthday. Try again later.", ephemeral=True)
@@ -128,60 +96,31 @@ class Birthdays(commands.Cog):
         await interaction.response.defer(ephemeral=True)
 
         try:
-            birthdays = await self.bot.db.get_birthdays(interaction.guild.id)
-            if not birthdays:
+            today = dt.datetime.now(dt.timezone.utc)
+            first_page = self.bot.db.get_upcoming_birthdays(interaction.guild.id, today.date(), ENTRIES_PER_PAGE)
+            if not first_page:
                 await interaction.followup.send("📂 No birthdays found yet.", ephemeral=True)
                 return
 
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [
-                uid for uid, bday in birthdays 
-                if is_birthday_on_date(bday, today)
-                and (member := interaction.guild.get_member(uid)) and not member.bot
-            ]
-            await update_pinned_birthday_message(
-                interaction.guild,
-                db=self.bot.db,
-                highlight_today=birthdays_today,
-                manual=True
-            )
-
-            # Sort upcoming birthdays
-            def upcoming_sort_key(b):
-                month, day = map(int, b[1].split("-"))
-                try:
-                    current = dt.datetime(today.year, month, day, tzinfo=dt.timezone.utc)
-                except ValueError:
-                    if month == 2 and day == 29:
-                        current = dt.datetime(today.year, 2, 28, tzinfo=dt.timezone.utc)
-                    else:
-                        logger.warning(f"Invalid birthday {b[1]} for user {b[0]}")
-                        return float("inf")
-                if current < today and not is_birthday_on_date(b[1], today):
-                    try:
-                        current = dt.datetime(today.year + 1, month, day, tzinfo=dt.timezone.utc)
-                    except ValueError:
-                        if month == 2 and day == 29:
-                            current = dt.datetime(today.year + 1, 2, 28, tzinfo=dt.timezone.utc)
-                        else:
-                            return float("inf")
-                return (current - today).total_seconds()
-
-            birthdays_sorted = sorted(birthdays, key=upcoming_sort_key)
-            first_page = birthdays_sorted[:ENTRIES_PER_PAGE]
+            self.bot.pinned_refresh.mark_dirty(interaction.guild)
 
             guild_config = await self.bot.db.get_guild_config(interaction.guild.id)
             check_hour = guild_config.get("check_hour", 7)
 
             lines = []
             for uid, bday in first_page:
-                try:
-                    member = interaction.guild.get_member(uid) or await interaction.guild.fetch_member(uid)
-                    if member.bot:
-                        continue  # Skip bot
-                    display_name = member.display_name
-                except discord.NotFound:
-                    display_name = f"User {uid}"
+                # Cached member first, then the stored name snapshot; the API only as a last resort
+                member = interaction.guild.get_member(uid)
+                display_name = member.display_name if member else self.bot.db.display_name(interaction.guild.id, uid)
+                if display_name is None:
+                    try:
+                        member = await interaction.guild.fetch_member(uid)
+                        display_name = member.display_name
+                        await self.bot.db.update_display_name(interaction.guild.id, uid, display_name)
+                    except discord.NotFound:
+                        display_name = f"User {uid}"
+                if member and member.bot:
+                    continue  # Skip bot
                 prefix = "・"
                 if is_birthday_on_date(bday, today):
                     prefix += CONFETTI_ICON
@@ -20,18 +20,14 @@ class DebugCog(commands.Cog):
 
         await interaction.response.defer(thinking=True, ephemeral=True)
 
-        db_conn = self.bot.db.db  # Persistent connection
         try:
-            async with db_conn.execute(
-                "SELECT user_id, date FROM wished_today WHERE guild_id = ?", (interaction.guild.id,)
-            ) as cursor:
-                rows = await cursor.fetchall()
+            rows = await self.bot.db.get_wished_entries(interaction.guild.id)
 
             if not rows:
                 await interaction.followup.send("✅ No one has been wished today in this server.")
                 return
 
-            message = "\n".join([f"<@{row['user_id']}> — {row['date']}" for row in rows])
+            message = "\n".join([f"<@{user_id}> — {date}" for user_id, date in rows])
             await interaction.followup.send(
                 f"📋 **Already Wished Today:**\n{message}", ephemeral=True
             )
@@ -50,12 +46,8 @@ class DebugCog(commands.Cog):
 
         await interaction.response.defer(thinking=True, ephemeral=True)
 
-        db_conn = self.bot.db.db  # Persistent connection
         try:
-            await db_conn.execute(
-                "DELETE FROM wished_today WHERE guild_id = ?", (interaction.guild.id,)
-            )
-            await db_conn.commit()
+            await self.bot.db.clear_wished(interaction.guild.id)
             await interaction.followup.send("🗑️ Cleared wished users for this guild.", ephemeral=True)
         except Exception as e:
             logger.error(f"Error clearing wished_today for guild {interaction.guild.name}: {e}", exc_info=True)
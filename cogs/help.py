@@ -19,7 +19,7 @@ class Help(commands.Cog):
             "**🛡️ Admin/Mod Commands:**\n"
             "• `/setuserbirthday user day month` – Set another user's birthday.\n"
             "• `/deleteuserbirthday user` – Delete a user's birthday.\n"
-            "• `/importbirthdays channel message_id` – Import birthdays from a message.\n"
+            "• `/importbirthdays channel message_id` or `/importbirthdays file` – Import birthdays from a message or a CSV, JSON or JSON Lines (`.jsonl`) file (max 5 MB).\n"
             "• `/testdate DD/MM/YYYY` – Run a birthday check for a specific date.\n\n"
 
             "**👑 Admin-Only Commands:**\n"
@@ -1,31 +1,64 @@
 # cogs/member_cleanup.py
+import asyncio
 import discord
 from discord.ext import commands
-from utils import update_pinned_birthday_message
+from config import MEMBER_REMOVE_BATCH_SECONDS
 from logger import logger
 
 class MemberCleanup(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # Departed members with a stored birthday, per guild, waiting for the batched delete
+        self._departed: dict[int, set[int]] = {}
+        self._pending: dict[int, asyncio.Task] = {}
 
     @commands.Cog.listener()
-    async def on_member_remove(self, member: discord.Member):
-        guild_id = member.guild.id
-        user_id = member.id
+    async def on_member_join(self, member: discord.Member):
+        # A member who comes straight back keeps their birthday
+        self._departed.get(member.guild.id, set()).discard(member.id)
+        # Name snapshots are only kept (and only change anything) for users with a birthday
+        await self.bot.db.update_display_name(member.guild.id, member.id, member.display_name)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # Only fires for cached members, which are the ones with birthdays
+        if before.display_name != after.display_name:
+            await self.bot.db.update_display_name(after.guild.id, after.id, after.display_name)
+
+    @commands.Cog.listener()
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        # The raw event fires for uncached members too; most of the cache is never loaded
+        guild_id, user = payload.guild_id, payload.user
+        # Most leavers never set a birthday; the in-memory index answers that without touching the DB
+        if not self.bot.db.has_birthday(guild_id, user.id):
+            return
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+
+        self._departed.setdefault(guild_id, set()).add(user.id)
+        logger.info(f"👋 {user.display_name} left {guild.name}, their birthday will be removed")
+        if guild_id not in self._pending:
+            self._pending[guild_id] = asyncio.create_task(self._remove_departed_later(guild))
+
+    async def _remove_departed_later(self, guild: discord.Guild):
+        """Deletes a burst of departed members' birthdays in one write, followed by one pinned refresh."""
+        try:
+            await asyncio.sleep(MEMBER_REMOVE_BATCH_SECONDS)
+        finally:
+            self._pending.pop(guild.id, None)
+            user_ids = list(self._departed.pop(guild.id, ()))
+
+        if not user_ids:
+            return
         try:
-            # Delete the birthday from DB using persistent connection
-            await self.bot.db.delete_birthday(guild_id, user_id)
-
-            # Refresh pinned birthday message (pass db!)
-            await update_pinned_birthday_message(member.guild, db=self.bot.db, manual=True)
-            logger.info(
-                f"👋 Removed {member.display_name}'s birthday because they left the server and refreshed pinned message in {member.guild.name}"
-            )
+            await self.bot.db.delete_birthdays(guild.id, user_ids)
+
+            # Refresh pinned birthday message once the burst of leaves has settled
+            self.bot.pinned_refresh.mark_dirty(guild)
+            logger.info(f"👋 Removed {len(user_ids)} birthdays of members who left {guild.name}")
         except Exception as e:
-            logger.error(
-                f"🚨 Error removing birthday for {member.display_name} in {member.guild.name}: {e}",
-                exc_info=True
-            )
+            logger.error(f"🚨 Error removing birthdays of departed members in {guild.name}: {e}", exc_info=True)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(MemberCleanup(bot))
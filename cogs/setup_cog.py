@@ -1,9 +1,8 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-from utils import update_pinned_birthday_message, is_birthday_on_date
+from resolver import resolver
 from logger import logger
-import datetime as dt
 
 class SetupCog(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -21,7 +20,9 @@ class SetupCog(commands.Cog):
         channel: discord.TextChannel,
         birthday_role: discord.Role = None,
         mod_role: discord.Role = None,
-        check_hour: int = 9
+        check_hour: int = 9,
+        combine_announcements: bool = False,
+        resync_commands: bool = False
     ):
         check_hour = max(0, min(check_hour, 23))
 
@@ -40,39 +41,31 @@ class SetupCog(commands.Cog):
         try:
             # Save config via persistent DB
             await self.bot.db.set_guild_config(
-                guild_id=str(interaction.guild.id),
-                channel_id=str(channel.id),
-                birthday_role_id=str(birthday_role.id) if birthday_role else None,
-                mod_role_id=str(mod_role.id) if mod_role else None,
-                check_hour=check_hour
+                guild_id=interaction.guild.id,
+                channel_id=channel.id,
+                birthday_role_id=birthday_role.id if birthday_role else None,
+                mod_role_id=mod_role.id if mod_role else None,
+                check_hour=check_hour,
+                combine_announcements=combine_announcements
             )
+            # The new channel/role get a fresh chance, whatever failed to resolve before
+            previous_problems = resolver.misconfigured_reasons(interaction.guild.id)
+            resolver.clear_guild(interaction.guild.id)
+            # Re-arm the daily check for the (possibly new) check hour
+            await self.bot.scheduler.schedule_guild(interaction.guild.id)
 
-            # Highlight birthdays happening today
-            birthdays = await self.bot.db.get_birthdays(str(interaction.guild.id))
-            today = dt.datetime.now(dt.timezone.utc)
-            birthdays_today = [
-                user_id for user_id, bday in birthdays
-                if is_birthday_on_date(bday, today)
-            ]
-
-            pinned_msg = await update_pinned_birthday_message(
-                interaction.guild,
-                db=self.bot.db,
-                highlight_today=birthdays_today,
-                manual=True
-            )
+            # Manual: re-sends the list if it was deleted and re-pins it if it was unpinned
+            await self.bot.pinned_refresh.refresh_now(interaction.guild, manual=True)
 
-            if pinned_msg and not pinned_msg.pinned:
-                try:
-                    await pinned_msg.pin()
-                    logger.info(f"Pinned birthday message for guild {interaction.guild.name} after setup.")
-                except discord.Forbidden:
-                    logger.warning(f"Cannot pin birthday message in {interaction.guild.name}, missing permission.")
+            # Check the new channel/role the same way the daily check will
+            await resolver.resolve_channel(interaction.guild, channel.id)
+            if birthday_role:
+                await resolver.resolve_role(interaction.guild, birthday_role.id)
+            problems = resolver.misconfigured_reasons(interaction.guild.id)
 
-            # Sync commands for this guild only
+            # Sync commands for this guild only, and only if they changed since the last sync
             try:
-                await self.bot.tree.sync(guild=interaction.guild)
-                logger.info(f"Commands synced for guild {interaction.guild.name}")
+                await self.bot.sync_commands(guild=interaction.guild, force=resync_commands)
             except Exception as e:
                 logger.error(f"Failed to sync commands for {interaction.guild.name}: {e}")
 
@@ -81,13 +74,21 @@ class SetupCog(commands.Cog):
                 "✅ HWB-BirthdayHelper is now configured!",
                 f"Birthdays will post in {channel.mention} at {check_hour}:00 UTC.",
                 f"{'Birthday role: ' + birthday_role.mention if birthday_role else 'No birthday role set.'}",
-                f"{'Moderator role: ' + mod_role.mention if mod_role else 'Admin-only for mod commands.'}"
+                f"{'Moderator role: ' + mod_role.mention if mod_role else 'Admin-only for mod commands.'}",
+                "All of a day's birthdays share one announcement." if combine_announcements
+                else "Each birthday gets its own announcement."
             ]
             if birthday_role:
                 confirmation_lines.append(
                     "⚠️ Make sure HWB-BirthdayHelper's bot role is higher than the birthday role "
                     "in the server role hierarchy, otherwise it cannot assign it."
                 )
+            if problems:
+                confirmation_lines.append(
+                    "🚧 Still misconfigured: " + "; ".join(problems) + ". Birthdays may not be posted."
+                )
+            elif previous_problems:
+                confirmation_lines.append("🔧 Fixed: " + "; ".join(previous_problems) + ".")
 
             logger.info(f"Bot setup completed by {interaction.user} in {interaction.guild.name}")
             await interaction.followup.send("\n".join(confirmation_lines), ephemeral=True)
@@ -5,5 +5,30 @@ load_dotenv()
 
 DB_FILE = "birthdays.db"
 BOT_TOKEN = os.getenv("DISCORD_TOKEN")
-BIRTHDAY_INTERVAL_MINUTES = 5
-GUILD_IDS = []  # Add test guild IDs here if needed
\ No newline at end of file
+GUILD_IDS = []  # Add test guild IDs here if needed
+
+# Slash commands are only re-synced when the command tree changes; set FORCE_COMMAND_SYNC=1 to sync anyway
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "").lower() in ("1", "true", "yes")
+
+# Guild passes (daily checks, midnight resets) run concurrently up to this limit,
+# and each pass is cancelled if it exceeds its time budget
+MAX_CONCURRENT_GUILD_PASSES = 10
+GUILD_PASS_TIMEOUT_SECONDS = 120
+
+# Pinned birthday lists are rebuilt at most once per this many seconds per guild
+PINNED_REFRESH_DEBOUNCE_SECONDS = 5
+
+# Database writes arriving within this window are committed together in one transaction
+DB_WRITE_GROUP_WINDOW_MS = 5
+
+# Read-only SQLite connections kept open for SELECTs, alongside the single writer
+DB_READ_POOL_SIZE = 4
+
+# Outbound budgets as (requests, per seconds): birthday messages per channel, role grants per guild,
+# plus how many role grants a guild may have in flight at once
+CHANNEL_SEND_BUDGET = (5, 5.0)
+ROLE_GRANT_BUDGET = (10, 10.0)
+ROLE_GRANT_CONCURRENCY = 3
+
+# Birthdays of members who leave are deleted in one batch per guild after this many seconds
+MEMBER_REMOVE_BATCH_SECONDS = 2
@@ -1,15 +1,80 @@
 # database.py
+import asyncio
+import calendar
+import datetime as dt
+import time
+from typing import Iterable
 import aiosqlite
-from config import DB_FILE
+import birthday_calendar
+from config import DB_FILE, DB_WRITE_GROUP_WINDOW_MS, DB_READ_POOL_SIZE
 from logger import logger
 
+# Applied to every connection. WAL lets readers run alongside the writer; with WAL,
+# synchronous=NORMAL only fsyncs at checkpoints, and can't corrupt the database on a crash.
+CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",  # 16 MB page cache per connection
+    "PRAGMA mmap_size = 268435456",  # 256 MB memory-mapped I/O
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+]
+
+# Keeps the stored display name snapshot when an upsert doesn't carry a new one
+UPSERT_BIRTHDAY = """
+    INSERT INTO birthdays (guild_id, user_id, birthday, month, day, display_name) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        birthday = excluded.birthday,
+        month = excluded.month,
+        day = excluded.day,
+        display_name = COALESCE(excluded.display_name, birthdays.display_name)
+"""
+
+# Tables keyed by guild_id (the config table holds per-guild keys too, see purge_guild)
+GUILD_TABLES = ["birthdays", "guild_config", "wished_today", "birthday_role_grants", "guild_schedule_state"]
+
 class Database:
-    """Manages all database operations with a single, persistent connection."""
+    """
+    Manages all database operations over persistent connections: one writer
+    (fed by the group-commit write queue) and a small pool of read-only
+    connections, so SELECTs don't queue behind each other or behind writes.
+    """
 
     def __init__(self, db_file: str):
         """Initializes the Database manager."""
         self.db_file = db_file
-        self.db: aiosqlite.Connection | None = None
+        self.db: aiosqlite.Connection | None = None  # The writer
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._reader_connections: list[aiosqlite.Connection] = []
+
+        # Write-through cache of guild_config rows, keyed by guild ID
+        self._guild_configs: dict[int, dict] = {}
+        self._guild_configs_loaded = False
+        self.config_cache_hits = 0
+        self.config_cache_misses = 0
+
+        # Bumped on every birthday mutation so caches built from a guild's birthdays can tell they're stale
+        self._birthday_revisions: dict[int, int] = {}
+
+        # Per-guild day-of-year index: 366 buckets of user IDs (see birthday_calendar slots),
+        # plus each user's slot so updates can move them between buckets
+        self._day_buckets: dict[int, list[set[int]]] = {}
+        self._user_slots: dict[int, dict[int, int | None]] = {}
+        # Last known display name of each user with a birthday, so lists render without a cached Member
+        self._display_names: dict[int, dict[int, str]] = {}
+
+        # Group-commit write queue: (sql, params, many, future, enqueued_at) entries waiting to be flushed
+        self._pending_writes: list[tuple[str, tuple | list, bool, asyncio.Future, float]] = []
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+        self.write_stats = {
+            "flushes": 0,
+            "writes": 0,
+            "failed": 0,
+            "last_batch": 0,
+            "max_batch": 0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+        }
 
     async def connect(self):
         """Establishes the database connection and sets up the row factory."""
@@ -19,25 +84,92 @@ class Database:
 
         self.db = await aiosqlite.connect(self.db_file)
         self.db.row_factory = aiosqlite.Row
-        logger.info("✅ Database connection established.")
+        async with self.db.execute("PRAGMA journal_mode = WAL") as cursor:
+            journal_mode = (await cursor.fetchone())[0]
+        for pragma in CONNECTION_PRAGMAS:
+            await self.db.execute(pragma)
+
+        # The writer has created the file (and WAL index), so read-only connections can attach to it
+        for _ in range(DB_READ_POOL_SIZE):
+            reader = await aiosqlite.connect(f"file:{self.db_file}?mode=ro", uri=True)
+            reader.row_factory = aiosqlite.Row
+            for pragma in CONNECTION_PRAGMAS:
+                await reader.execute(pragma)
+            self._reader_connections.append(reader)
+            self._readers.put_nowait(reader)
+
+        logger.info(
+            f"✅ Database connection established (journal_mode={journal_mode}, {DB_READ_POOL_SIZE} read connections)."
+        )
 
     async def close(self):
-        """Closes the database connection if it exists."""
+        """Closes the database connections if they exist, flushing any queued writes first."""
         if self.db:
+            await self.flush()
+            for reader in self._reader_connections:
+                await reader.close()
+            self._reader_connections.clear()
+            self._readers = asyncio.Queue()
             await self.db.close()
             logger.info("❌ Database connection closed.")
 
     async def init_db(self):
-        """Creates the necessary tables if they do not already exist."""
-        # Note: All ID columns are now INTEGER for better performance and storage.
+        """Brings the schema up to date, then loads the in-memory caches."""
+        await self.migrate()
+        await self.load_guild_configs()
+        await self.load_birthday_index()
+
+    # -------------------- Migrations --------------------
+    async def migrate(self):
+        """
+        Runs every migration newer than the database's recorded schema version
+        (PRAGMA user_version), each in its own transaction with the version bump.
+        """
+        migrations = [
+            (1, "base schema", self._migration_base_schema),
+            (2, "integer IDs in wished_today", self._migration_wished_today_integer_ids),
+            (3, "integer IDs everywhere else", self._migration_normalise_ids),
+            (4, "combined announcement option", self._migration_combine_announcements),
+            (5, "display name snapshots", self._migration_display_names),
+        ]
+
+        async with self.db.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+
+        for target, description, migration in migrations:
+            if target <= version:
+                continue
+            await self.db.execute("BEGIN")
+            try:
+                await migration()
+                await self.db.execute(f"PRAGMA user_version = {target}")
+                await self.db.commit()
+            except Exception:
+                await self.db.rollback()
+                logger.error(f"❌ Database migration {target} ({description}) failed.", exc_info=True)
+                raise
+            logger.info(f"🛠️ Applied database migration {target}: {description}.")
+            version = target
+
+        logger.info(f"✅ Database tables initialized (schema version {version}).")
+
+    async def _table_columns(self, table: str) -> dict[str, str]:
+        async with self.db.execute(f"PRAGMA table_info({table})") as cursor:
+            return {row["name"]: row["type"].upper() for row in await cursor.fetchall()}
+
+    async def _migration_base_schema(self):
+        # Also brings databases from before versioning up to this point, so everything is idempotent
         await self.db.execute("""
             CREATE TABLE IF NOT EXISTS birthdays (
                 guild_id INTEGER NOT NULL,
                 user_id INTEGER NOT NULL,
                 birthday TEXT NOT NULL,
+                month INTEGER,
+                day INTEGER,
                 PRIMARY KEY (guild_id, user_id)
             )
         """)
+        await self._migrate_birthday_month_day()
         await self.db.execute("""
             CREATE TABLE IF NOT EXISTS guild_config (
                 guild_id INTEGER PRIMARY KEY,
@@ -53,70 +185,580 @@ class Database:
                 value TEXT
             )
         """)
-        await self.db.commit()
-        logger.info("✅ Database tables initialized.")
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS birthday_role_grants (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                role_id INTEGER NOT NULL,
+                granted_at TEXT NOT NULL,
+                PRIMARY KEY (guild_id, user_id)
+            )
+        """)
+        await self.db.execute("""
+            CREATE TABLE IF NOT EXISTS guild_schedule_state (
+                guild_id INTEGER PRIMARY KEY,
+                last_checked_date TEXT,
+                last_reset_date TEXT
+            )
+        """)
 
-    # -------------------- Birthday Operations --------------------
-    async def set_birthday(self, guild_id: int, user_id: int, birthday: str):
-        """Sets or updates a user's birthday in a specific guild."""
+    async def _migrate_birthday_month_day(self):
+        """Adds and backfills the integer month/day columns on older databases."""
+        columns = await self._table_columns("birthdays")
+        for column in ("month", "day"):
+            if column not in columns:
+                await self.db.execute(f"ALTER TABLE birthdays ADD COLUMN {column} INTEGER")
+                logger.info(f"🛠️ Added '{column}' column to birthdays table.")
+
+        # Rows written before the columns existed only carry the 'MM-DD' string
+        await self.db.execute("""
+            UPDATE birthdays
+            SET month = CAST(substr(birthday, 1, 2) AS INTEGER),
+                day = CAST(substr(birthday, 4, 2) AS INTEGER)
+            WHERE month IS NULL OR day IS NULL
+        """)
         await self.db.execute(
-            "INSERT OR REPLACE INTO birthdays (guild_id, user_id, birthday) VALUES (?, ?, ?)",
-            (guild_id, user_id, birthday),
+            "CREATE INDEX IF NOT EXISTS idx_birthdays_month_day ON birthdays (month, day, guild_id)"
         )
-        await self.db.commit()
 
-    async def delete_birthday(self, guild_id: int, user_id: int):
-        """Deletes a user's birthday from a specific guild."""
+    async def _migration_wished_today_integer_ids(self):
+        # wished_today used to be created with TEXT IDs; SQLite can't change a column's type, so rebuild it
+        columns = await self._table_columns("wished_today")
+        await self.db.execute("""
+            CREATE TABLE wished_today_new (
+                guild_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                PRIMARY KEY (guild_id, user_id, date)
+            )
+        """)
+        if columns:
+            await self.db.execute("""
+                INSERT OR IGNORE INTO wished_today_new (guild_id, user_id, date)
+                SELECT CAST(guild_id AS INTEGER), CAST(user_id AS INTEGER), date FROM wished_today
+            """)
+            await self.db.execute("DROP TABLE wished_today")
+        await self.db.execute("ALTER TABLE wished_today_new RENAME TO wished_today")
+
+        # Per-guild lookups for a date, and the cleanup of old dates
         await self.db.execute(
+            "CREATE INDEX idx_wished_today_guild_date ON wished_today (guild_id, date, user_id)"
+        )
+        await self.db.execute("CREATE INDEX idx_wished_today_date ON wished_today (date)")
+
+    async def _migration_normalise_ids(self):
+        # IDs once passed as strings could be stored as TEXT despite the INTEGER columns
+        id_columns = {
+            "birthdays": ["guild_id", "user_id"],
+            "guild_config": ["guild_id", "channel_id", "birthday_role_id", "mod_role_id"],
+            "birthday_role_grants": ["guild_id", "user_id", "role_id"],
+            "guild_schedule_state": ["guild_id"],
+        }
+        for table, columns in id_columns.items():
+            for column in columns:
+                await self.db.execute(
+                    f"UPDATE OR REPLACE {table} SET {column} = CAST({column} AS INTEGER) WHERE typeof({column}) = 'text'"
+                )
+
+    async def _migration_combine_announcements(self):
+        await self.db.execute("ALTER TABLE guild_config ADD COLUMN combine_announcements INTEGER NOT NULL DEFAULT 0")
+
+    async def _migration_display_names(self):
+        await self.db.execute("ALTER TABLE birthdays ADD COLUMN display_name TEXT")
+
+    # -------------------- Write Queue --------------------
+    async def write(self, sql: str, params: tuple | list = (), many: bool = False, durable: bool = True) -> int | None:
+        """
+        Queues a write to be committed together with any others arriving within
+        DB_WRITE_GROUP_WINDOW_MS, so a burst of mutations costs one commit.
+
+        With durable=True (the default) this waits until the write is committed,
+        raises if it failed, and returns the number of rows it changed. With
+        durable=False it returns None as soon as the write is queued; a failure
+        is only logged, and reads don't see the write until it's committed, so
+        it's only for data that is also kept in memory. `many` runs the
+        statement via executemany.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending_writes.append((sql, params, many, future, time.perf_counter()))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+        if durable:
+            return await future
+        future.add_done_callback(self._log_failed_write)
+        return None
+
+    @staticmethod
+    def _log_failed_write(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logger.error(f"❌ Queued database write failed: {future.exception()}")
+
+    async def _flush_soon(self):
+        # Keeps going while writes arrive during a flush, so none are left waiting for a timer
+        while self._pending_writes:
+            await asyncio.sleep(DB_WRITE_GROUP_WINDOW_MS / 1000)
+            await self.flush()
+
+    async def flush(self):
+        """Commits every queued write now, in one transaction."""
+        async with self._flush_lock:
+            batch, self._pending_writes = self._pending_writes, []
+            if not batch:
+                return
+
+            try:
+                results = [(await self._execute(sql, params, many), None) for sql, params, many, _, _ in batch]
+                await self.db.commit()
+            except Exception as e:
+                # Don't let one bad statement fail the whole group: retry each on its own
+                logger.warning(f"⚠️ Grouped write of {len(batch)} statements failed ({e}), retrying individually")
+                await self.db.rollback()
+                results = [await self._write_one(sql, params, many) for sql, params, many, _, _ in batch]
+
+            committed_at = time.perf_counter()
+            latencies = [(committed_at - enqueued_at) * 1000 for *_, enqueued_at in batch]
+            stats = self.write_stats
+            stats["flushes"] += 1
+            stats["writes"] += len(batch)
+            stats["failed"] += sum(error is not None for _, error in results)
+            stats["last_batch"] = len(batch)
+            stats["max_batch"] = max(stats["max_batch"], len(batch))
+            stats["total_latency_ms"] += sum(latencies)
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], *latencies)
+
+            for (*_, future, _), (rowcount, error) in zip(batch, results):
+                if future.done():
+                    continue  # The caller was cancelled; the write still happened
+                if error is None:
+                    future.set_result(rowcount)
+                else:
+                    future.set_exception(error)
+
+    async def _execute(self, sql: str, params: tuple | list, many: bool) -> int:
+        if many:
+            cursor = await self.db.executemany(sql, params)
+        else:
+            cursor = await self.db.execute(sql, params)
+        return cursor.rowcount
+
+    async def _write_one(self, sql: str, params: tuple | list, many: bool) -> tuple[int | None, Exception | None]:
+        try:
+            rowcount = await self._execute(sql, params, many)
+            await self.db.commit()
+            return rowcount, None
+        except Exception as e:
+            await self.db.rollback()
+            return None, e
+
+    def write_queue_stats(self) -> dict:
+        """Returns group-commit counters: flush sizes and enqueue-to-commit latency."""
+        stats = dict(self.write_stats)
+        stats["queued"] = len(self._pending_writes)
+        stats["avg_batch"] = stats["writes"] / stats["flushes"] if stats["flushes"] else 0.0
+        stats["avg_latency_ms"] = stats["total_latency_ms"] / stats["writes"] if stats["writes"] else 0.0
+        return stats
+
+    async def fetchall(self, sql: str, params: tuple | list = ()) -> list[aiosqlite.Row]:
+        """Runs a read query on a pooled read-only connection, alongside any commit in progress."""
+        reader = await self._readers.get()
+        try:
+            async with reader.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+        finally:
+            self._readers.put_nowait(reader)
+
+    async def fetchone(self, sql: str, params: tuple | list = ()) -> aiosqlite.Row | None:
+        """Like fetchall, for a single row."""
+        reader = await self._readers.get()
+        try:
+            async with reader.execute(sql, params) as cursor:
+                return await cursor.fetchone()
+        finally:
+            self._readers.put_nowait(reader)
+
+    # -------------------- Birthday Operations --------------------
+    async def set_birthday(self, guild_id: int, user_id: int, birthday: str, durable: bool = True, display_name: str | None = None):
+        """Sets or updates a user's birthday in a specific guild (keeping their name snapshot unless a new one is given)."""
+        month, day = map(int, birthday.split("-"))
+        await self.write(UPSERT_BIRTHDAY, (guild_id, user_id, birthday, month, day, display_name), durable=durable)
+        self._index_birthday(guild_id, user_id, birthday)
+        if display_name is not None:
+            self._display_names.setdefault(guild_id, {})[user_id] = display_name
+        self._bump_birthday_revision(guild_id)
+
+    async def bulk_set_birthdays(self, guild_id: int, entries: Iterable[tuple[int, str]], chunk_size: int = 500, progress=None) -> int:
+        """
+        Sets or updates many birthdays in a guild, one transaction per chunk.
+
+        `entries` yields (user_id, 'MM-DD') pairs and is consumed lazily, so it can
+        be a generator over a file being parsed. `progress`, if given, is awaited
+        with the running total after each chunk. Returns the number of rows written.
+        """
+        written = 0
+        chunk: list[tuple[int, int, str, int, int, None]] = []
+
+        async def flush():
+            nonlocal written
+            await self.write(UPSERT_BIRTHDAY, list(chunk), many=True)
+            for _, user_id, birthday, _, _, _ in chunk:
+                self._index_birthday(guild_id, user_id, birthday)
+            self._bump_birthday_revision(guild_id)
+            written += len(chunk)
+            chunk.clear()
+            if progress:
+                await progress(written)
+
+        for user_id, birthday in entries:
+            month, day = map(int, birthday.split("-"))
+            chunk.append((guild_id, user_id, birthday, month, day, None))
+            if len(chunk) >= chunk_size:
+                await flush()
+        if chunk:
+            await flush()
+        return written
+
+    async def delete_birthday(self, guild_id: int, user_id: int, durable: bool = True):
+        """Deletes a user's birthday from a specific guild."""
+        await self.write(
             "DELETE FROM birthdays WHERE guild_id = ? AND user_id = ?",
             (guild_id, user_id),
+            durable=durable,
         )
-        await self.db.commit()
+        self._forget_user(guild_id, user_id)
+        self._bump_birthday_revision(guild_id)
+
+    async def delete_birthdays(self, guild_id: int, user_ids: list[int], durable: bool = True):
+        """Deletes many users' birthdays from a guild in one statement."""
+        if not user_ids:
+            return
+        await self.write(
+            "DELETE FROM birthdays WHERE guild_id = ? AND user_id = ?",
+            [(guild_id, user_id) for user_id in user_ids],
+            many=True,
+            durable=durable,
+        )
+        for user_id in user_ids:
+            self._forget_user(guild_id, user_id)
+        self._bump_birthday_revision(guild_id)
+
+    def has_birthday(self, guild_id: int, user_id: int) -> bool:
+        """Whether a user has a birthday stored in a guild (answered from the in-memory index)."""
+        return user_id in self._user_slots.get(guild_id, ())
+
+    async def delete_guild_birthdays(self, guild_id: int):
+        """Deletes every birthday stored for a guild."""
+        await self.write("DELETE FROM birthdays WHERE guild_id = ?", (guild_id,))
+        self._day_buckets.pop(guild_id, None)
+        self._user_slots.pop(guild_id, None)
+        self._display_names.pop(guild_id, None)
+        self._bump_birthday_revision(guild_id)
+
+    def _bump_birthday_revision(self, guild_id: int):
+        self._birthday_revisions[guild_id] = self._birthday_revisions.get(guild_id, 0) + 1
+
+    def birthday_revision(self, guild_id: int) -> int:
+        """Returns a counter that changes whenever the guild's birthdays change."""
+        return self._birthday_revisions.get(guild_id, 0)
 
     async def get_birthdays(self, guild_id: int) -> list[tuple[int, str]]:
         """Fetches all birthdays for a given guild."""
         try:
-            async with self.db.execute(
-                "SELECT user_id, birthday FROM birthdays WHERE guild_id = ?", (guild_id,)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                # Convert list of Row objects to a list of tuples
-                return [(row["user_id"], row["birthday"]) for row in rows]
+            rows = await self.fetchall("SELECT user_id, birthday FROM birthdays WHERE guild_id = ?", (guild_id,))
+            # Convert list of Row objects to a list of tuples
+            return [(row["user_id"], row["birthday"]) for row in rows]
         except Exception as e:
             logger.error(f"Error fetching birthdays for guild {guild_id}: {e}", exc_info=True)
             return []
 
+    # -------------------- Birthday Index --------------------
+    # Date lookups (get_todays_celebrants) are answered from this index, not from the month/day columns
+    async def load_birthday_index(self):
+        """Builds the in-memory day-of-year index from every stored birthday."""
+        self._day_buckets.clear()
+        self._user_slots.clear()
+        self._display_names.clear()
+        async with self.db.execute("SELECT guild_id, user_id, birthday, display_name FROM birthdays") as cursor:
+            rows = await cursor.fetchall()
+        for row in rows:
+            self._index_birthday(row["guild_id"], row["user_id"], row["birthday"])
+            if row["display_name"] is not None:
+                self._display_names.setdefault(row["guild_id"], {})[row["user_id"]] = row["display_name"]
+        logger.info(f"📅 Indexed {len(rows)} birthdays across {len(self._day_buckets)} guilds.")
+
+    def _index_birthday(self, guild_id: int, user_id: int, birthday: str):
+        self._unindex_birthday(guild_id, user_id)
+        slot = birthday_calendar.birthday_slot(birthday)
+        # Users are tracked even with an invalid (legacy) date, so leaving and reconciliation still clean them up
+        self._user_slots.setdefault(guild_id, {})[user_id] = slot
+        if slot is None:
+            logger.warning(f"Not indexing invalid birthday '{birthday}' for user {user_id} in guild {guild_id}")
+            return
+        buckets = self._day_buckets.setdefault(guild_id, [set() for _ in range(birthday_calendar.SLOT_COUNT)])
+        buckets[slot].add(user_id)
+
+    def _unindex_birthday(self, guild_id: int, user_id: int):
+        slot = self._user_slots.get(guild_id, {}).pop(user_id, None)
+        if slot is not None:
+            self._day_buckets[guild_id][slot].discard(user_id)
+
+    def _forget_user(self, guild_id: int, user_id: int):
+        self._unindex_birthday(guild_id, user_id)
+        self._display_names.get(guild_id, {}).pop(user_id, None)
+
+    # -------------------- Display Name Snapshots --------------------
+    def display_name(self, guild_id: int, user_id: int) -> str | None:
+        """The last display name seen for a user with a birthday, if any."""
+        return self._display_names.get(guild_id, {}).get(user_id)
+
+    async def update_display_name(self, guild_id: int, user_id: int, display_name: str):
+        """Refreshes a birthday user's name snapshot; a no-op for anyone else or an unchanged name."""
+        if not self.has_birthday(guild_id, user_id) or self.display_name(guild_id, user_id) == display_name:
+            return
+        self._display_names.setdefault(guild_id, {})[user_id] = display_name
+        self._bump_birthday_revision(guild_id)  # Rendered lists show the name
+        await self.write(
+            "UPDATE birthdays SET display_name = ? WHERE guild_id = ? AND user_id = ?",
+            (display_name, guild_id, user_id),
+            durable=False,
+        )
+
+    def get_todays_celebrants(self, guild_id: int, date: dt.date) -> list[int]:
+        """Returns the users celebrating on the given date (Feb 29 birthdays on Feb 28 in common years)."""
+        buckets = self._day_buckets.get(guild_id)
+        if not buckets:
+            return []
+        slots = [birthday_calendar.date_slot(date)]
+        if date.month == 2 and date.day == 28 and not calendar.isleap(date.year):
+            slots.append(birthday_calendar.birthday_slot("02-29"))
+        return [user_id for slot in slots for user_id in buckets[slot]]
+
+    def get_upcoming_birthdays(self, guild_id: int, date: dt.date, limit: int) -> list[tuple[int, str]]:
+        """Returns up to `limit` (user_id, 'MM-DD') pairs in the order they come up, starting with the given date."""
+        buckets = self._day_buckets.get(guild_id)
+        if not buckets:
+            return []
+        upcoming = []
+        start = birthday_calendar.date_slot(date)
+        for offset in range(birthday_calendar.SLOT_COUNT):
+            slot = (start + offset) % birthday_calendar.SLOT_COUNT
+            birthday = birthday_calendar.slot_string(slot)
+            for user_id in buckets[slot]:
+                upcoming.append((user_id, birthday))
+                if len(upcoming) >= limit:
+                    return upcoming
+        return upcoming
+
+    # -------------------- Reconciliation --------------------
+    def birthday_user_ids(self, guild_id: int) -> set[int]:
+        """Every user with a birthday stored in a guild (from the in-memory index)."""
+        return set(self._user_slots.get(guild_id, ()))
+
+    async def get_stored_guild_ids(self) -> set[int]:
+        """Every guild ID that has rows in any table."""
+        guild_ids = set()
+        for table in GUILD_TABLES:
+            rows = await self.fetchall(f"SELECT DISTINCT guild_id FROM {table}")
+            guild_ids.update(row["guild_id"] for row in rows)
+        rows = await self.fetchall(
+            "SELECT key FROM config WHERE key LIKE 'pinned_birthday_%' OR key LIKE 'command_tree_hash:%'"
+        )
+        for row in rows:
+            suffix = row["key"].replace(":", "_").rsplit("_", 1)[-1]
+            if suffix.isdigit():
+                guild_ids.add(int(suffix))
+        return guild_ids
+
+    async def purge_members(self, guild_id: int, user_ids: list[int]) -> int:
+        """Deletes everything stored about the given users in a guild; returns the number of rows removed."""
+        if not user_ids:
+            return 0
+        params = [(guild_id, user_id) for user_id in user_ids]
+        counts = await asyncio.gather(*(
+            self.write(f"DELETE FROM {table} WHERE guild_id = ? AND user_id = ?", params, many=True)
+            for table in ("birthdays", "wished_today", "birthday_role_grants")
+        ))
+        for user_id in user_ids:
+            self._forget_user(guild_id, user_id)
+        self._bump_birthday_revision(guild_id)
+        return sum(counts)
+
+    async def purge_guild(self, guild_id: int) -> int:
+        """Deletes everything stored for a guild; returns the number of rows removed."""
+        # Queued together, so they land in the same group commit
+        counts = await asyncio.gather(
+            *(self.write(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,)) for table in GUILD_TABLES),
+            self.write(
+                "DELETE FROM config WHERE key IN (?, ?, ?)",
+                (f"pinned_birthday_msg_{guild_id}", f"pinned_birthday_hash_{guild_id}", f"command_tree_hash:{guild_id}"),
+            ),
+        )
+        self._guild_configs.pop(guild_id, None)
+        self._day_buckets.pop(guild_id, None)
+        self._user_slots.pop(guild_id, None)
+        self._display_names.pop(guild_id, None)
+        self._bump_birthday_revision(guild_id)
+        return sum(counts)
+
     # -------------------- Guild Config Operations --------------------
-    async def set_guild_config(self, guild_id: int, channel_id: int, birthday_role_id: int | None, mod_role_id: int | None, check_hour: int):
+    async def load_guild_configs(self):
+        """Loads every guild_config row into the in-memory cache."""
+        async with self.db.execute("SELECT * FROM guild_config") as cursor:
+            rows = await cursor.fetchall()
+        self._guild_configs = {row["guild_id"]: dict(row) for row in rows}
+        self._guild_configs_loaded = True
+        logger.info(f"⚙️ Cached config for {len(self._guild_configs)} guilds.")
+
+    async def set_guild_config(self, guild_id: int, channel_id: int, birthday_role_id: int | None, mod_role_id: int | None, check_hour: int, combine_announcements: bool = False):
         """Sets or updates the configuration for a guild."""
-        await self.db.execute(
+        await self.write(
             """
-            INSERT OR REPLACE INTO guild_config (guild_id, channel_id, birthday_role_id, mod_role_id, check_hour)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT OR REPLACE INTO guild_config (guild_id, channel_id, birthday_role_id, mod_role_id, check_hour, combine_announcements)
+            VALUES (?, ?, ?, ?, ?, ?)
             """,
-            (guild_id, channel_id, birthday_role_id, mod_role_id, check_hour),
+            (guild_id, channel_id, birthday_role_id, mod_role_id, check_hour, int(combine_announcements)),
         )
-        await self.db.commit()
+
+        self._guild_configs[guild_id] = {
+            "guild_id": guild_id,
+            "channel_id": channel_id,
+            "birthday_role_id": birthday_role_id,
+            "mod_role_id": mod_role_id,
+            "check_hour": check_hour,
+            "combine_announcements": int(combine_announcements),
+        }
         logger.info(f"⚙️ Guild config updated for {guild_id}")
 
+    async def delete_guild_config(self, guild_id: int):
+        """Deletes a guild's configuration and evicts it from the cache."""
+        await self.write("DELETE FROM guild_config WHERE guild_id = ?", (guild_id,))
+        self._guild_configs.pop(guild_id, None)
+        logger.info(f"⚙️ Guild config deleted for {guild_id}")
+
     async def get_guild_config(self, guild_id: int) -> dict | None:
-        """Fetches the configuration for a specific guild."""
-        async with self.db.execute("SELECT * FROM guild_config WHERE guild_id = ?", (guild_id,)) as cursor:
-            row = await cursor.fetchone()
-            # Convert the Row object to a dictionary if a record was found
-            return dict(row) if row else None
+        """Fetches the configuration for a specific guild, served from the cache when possible."""
+        if guild_id in self._guild_configs:
+            self.config_cache_hits += 1
+            return dict(self._guild_configs[guild_id])
+        if self._guild_configs_loaded:
+            # The cache holds every row, so a missing entry means the guild isn't configured
+            self.config_cache_hits += 1
+            return None
+
+        self.config_cache_misses += 1
+        row = await self.fetchone("SELECT * FROM guild_config WHERE guild_id = ?", (guild_id,))
+        if not row:
+            return None
+        self._guild_configs[guild_id] = dict(row)
+        return dict(row)
+
+    def config_cache_stats(self) -> dict:
+        """Returns hit/miss counters for the guild config cache."""
+        lookups = self.config_cache_hits + self.config_cache_misses
+        return {
+            "cached_guilds": len(self._guild_configs),
+            "hits": self.config_cache_hits,
+            "misses": self.config_cache_misses,
+            "hit_rate": self.config_cache_hits / lookups if lookups else 0.0,
+        }
+
+    # -------------------- Wished Tracking --------------------
+    async def get_wished_users(self, guild_id: int, date_str: str) -> set[int]:
+        """Returns the IDs of everyone already wished in a guild on the given date."""
+        rows = await self.fetchall(
+            "SELECT user_id FROM wished_today WHERE guild_id = ? AND date = ?", (guild_id, date_str)
+        )
+        return {row["user_id"] for row in rows}
+
+    async def get_wished_entries(self, guild_id: int) -> list[tuple[int, str]]:
+        """Fetches (user_id, date) for every wished_today row of a guild."""
+        rows = await self.fetchall("SELECT user_id, date FROM wished_today WHERE guild_id = ?", (guild_id,))
+        return [(row["user_id"], row["date"]) for row in rows]
+
+    async def mark_users_as_wished(self, guild_id: int, user_ids: list[int], date_str: str):
+        """Records a guild pass's wished users in a single transaction."""
+        if not user_ids:
+            return
+        await self.write(
+            "INSERT OR IGNORE INTO wished_today (guild_id, user_id, date) VALUES (?, ?, ?)",
+            [(guild_id, user_id, date_str) for user_id in user_ids],
+            many=True,
+        )
+
+    async def clear_wished(self, guild_id: int, date_str: str | None = None):
+        """Forgets who was wished in a guild, on one date or on every date."""
+        if date_str is None:
+            await self.write("DELETE FROM wished_today WHERE guild_id = ?", (guild_id,))
+        else:
+            await self.write("DELETE FROM wished_today WHERE guild_id = ? AND date = ?", (guild_id, date_str))
+
+    async def clear_wished_before(self, cutoff_date: str):
+        """Deletes wished_today rows older than the given 'YYYY-MM-DD' date."""
+        await self.write("DELETE FROM wished_today WHERE date < ?", (cutoff_date,))
+
+    # -------------------- Birthday Role Grants --------------------
+    async def record_role_grants(self, guild_id: int, role_id: int, user_ids: list[int], granted_at: str):
+        """Records the members a guild's birthday role was given to, in one transaction."""
+        if not user_ids:
+            return
+        await self.write(
+            "INSERT OR REPLACE INTO birthday_role_grants (guild_id, user_id, role_id, granted_at) VALUES (?, ?, ?, ?)",
+            [(guild_id, user_id, role_id, granted_at) for user_id in user_ids],
+            many=True,
+        )
+
+    async def get_role_grants(self, guild_id: int) -> list[tuple[int, int, str]]:
+        """Fetches (user_id, role_id, granted_at) for every tracked birthday role holder in a guild."""
+        rows = await self.fetchall(
+            "SELECT user_id, role_id, granted_at FROM birthday_role_grants WHERE guild_id = ?", (guild_id,)
+        )
+        return [(row["user_id"], row["role_id"], row["granted_at"]) for row in rows]
+
+    async def delete_role_grants(self, guild_id: int, user_ids: list[int]):
+        """Forgets tracked birthday role holders once their role has been dealt with."""
+        if not user_ids:
+            return
+        await self.write(
+            "DELETE FROM birthday_role_grants WHERE guild_id = ? AND user_id = ?",
+            [(guild_id, user_id) for user_id in user_ids],
+            many=True,
+        )
+
+    # -------------------- Scheduler State --------------------
+    async def get_schedule_states(self) -> dict[int, tuple[str | None, str | None]]:
+        """Fetches (last_checked_date, last_reset_date) for every guild the scheduler has handled."""
+        rows = await self.fetchall("SELECT guild_id, last_checked_date, last_reset_date FROM guild_schedule_state")
+        return {row["guild_id"]: (row["last_checked_date"], row["last_reset_date"]) for row in rows}
+
+    async def set_last_checked_date(self, guild_id: int, date_str: str):
+        """Records the UTC date of a guild's last completed birthday check."""
+        await self.write(
+            """
+            INSERT INTO guild_schedule_state (guild_id, last_checked_date) VALUES (?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET last_checked_date = excluded.last_checked_date
+            """,
+            (guild_id, date_str),
+        )
+
+    async def set_last_reset_date(self, guild_id: int, date_str: str):
+        """Records the UTC date of a guild's last completed midnight reset."""
+        await self.write(
+            """
+            INSERT INTO guild_schedule_state (guild_id, last_reset_date) VALUES (?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET last_reset_date = excluded.last_reset_date
+            """,
+            (guild_id, date_str),
+        )
 
     # -------------------- Generic Config Operations --------------------
-    async def set_config_value(self, key: str, value: str):
+    async def set_config_value(self, key: str, value: str, durable: bool = True):
         """Sets a generic key-value pair in the config table."""
-        await self.db.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value)
+        await self.write(
+            "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value), durable=durable
         )
-        await self.db.commit()
         logger.debug(f"Config value set: {key} = {value}")
 
     async def get_config_value(self, key: str) -> str | None:
         """Gets a value from the generic config table by its key."""
-        async with self.db.execute("SELECT value FROM config WHERE key = ?", (key,)) as cursor:
-            row = await cursor.fetchone()
-            return row["value"] if row else None
\ No newline at end of file
+        row = await self.fetchone("SELECT value FROM config WHERE key = ?", (key,))
+        return row["value"] if row else None
\ No newline at end of file
@@ -0,0 +1,122 @@
+# dispatcher.py
+import asyncio
+import time
+import discord
+from config import CHANNEL_SEND_BUDGET, ROLE_GRANT_BUDGET, ROLE_GRANT_CONCURRENCY
+from logger import logger
+
+DISCORD_MESSAGE_LIMIT = 2000
+
+
+class TokenBucket:
+    """Allows `capacity` acquisitions per `per_seconds`, refilled continuously."""
+
+    def __init__(self, capacity: int, per_seconds: float):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """Waits for a token; returns how long that took in seconds."""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundDispatcher:
+    """
+    Sends announcements and grants roles within a budget, so a busy day stays
+    under Discord's per-channel and per-route rate limits instead of running
+    into 429s.
+
+    Messages are budgeted per channel (CHANNEL_SEND_BUDGET) and role grants per
+    guild (ROLE_GRANT_BUDGET), with at most ROLE_GRANT_CONCURRENCY grants in
+    flight per guild.
+    """
+
+    def __init__(self):
+        self._buckets: dict[tuple[str, int], TokenBucket] = {}
+        self._grant_slots: dict[int, asyncio.Semaphore] = {}
+        self.stats = {"messages": 0, "role_grants": 0, "throttled_seconds": 0.0}
+
+    def _bucket(self, route: str, key: int, budget: tuple[int, float]) -> TokenBucket:
+        bucket = self._buckets.get((route, key))
+        if bucket is None:
+            bucket = self._buckets[(route, key)] = TokenBucket(*budget)
+        return bucket
+
+    # -------------------- Messages --------------------
+    async def send(self, channel: discord.abc.Messageable, content: str, mentions: list[discord.abc.Snowflake] = ()) -> discord.Message:
+        """Sends a message once the channel's budget allows; only the given users are pinged."""
+        waited = await self._bucket("channel_send", channel.id, CHANNEL_SEND_BUDGET).acquire()
+        self.stats["throttled_seconds"] += waited
+        message = await channel.send(
+            content,
+            allowed_mentions=discord.AllowedMentions(everyone=False, roles=False, users=list(mentions)),
+        )
+        self.stats["messages"] += 1
+        return message
+
+    # -------------------- Role Grants --------------------
+    async def add_role(self, member: discord.Member, role: discord.Role, reason: str):
+        """Grants a role within the guild's concurrency limit and budget."""
+        guild_id = member.guild.id
+        slots = self._grant_slots.get(guild_id)
+        if slots is None:
+            slots = self._grant_slots[guild_id] = asyncio.Semaphore(ROLE_GRANT_CONCURRENCY)
+        async with slots:
+            waited = await self._bucket("member_role", guild_id, ROLE_GRANT_BUDGET).acquire()
+            self.stats["throttled_seconds"] += waited
+            await member.add_roles(role, reason=reason)
+        self.stats["role_grants"] += 1
+
+    async def add_roles(self, members: list[discord.Member], role: discord.Role, reason: str, on_granted=None) -> list[discord.Member]:
+        """
+        Grants a role to many members concurrently (bounded by `add_role`).
+
+        `on_granted(member)` is called as each grant succeeds; failures are
+        logged. Returns the members that got the role.
+        """
+        granted = []
+
+        async def grant(member: discord.Member):
+            try:
+                await self.add_role(member, role, reason)
+            except Exception as e:
+                logger.warning(f"❗ Could not add {role.name} to {member.display_name}: {e}")
+                return
+            granted.append(member)
+            if on_granted:
+                on_granted(member)
+
+        await asyncio.gather(*(grant(member) for member in members))
+        return granted
+
+
+def chunk_members(members: list[discord.Member], reserved: int, limit: int = DISCORD_MESSAGE_LIMIT) -> list[list[discord.Member]]:
+    """Splits members into groups whose ", "-joined mentions fit in a message alongside `reserved` other characters."""
+    room = limit - reserved
+    chunks, current, length = [], [], 0
+    for member in members:
+        extra = len(member.mention) + (2 if current else 0)
+        if current and length + extra > room:
+            chunks.append(current)
+            current, length = [], 0
+            extra = len(member.mention)
+        current.append(member)
+        length += extra
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+dispatcher = OutboundDispatcher()
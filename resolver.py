@@ -0,0 +1,115 @@
+# resolver.py
+import time
+import discord
+from logger import logger
+
+# -------------------- Settings --------------------
+POSITIVE_TTL_SECONDS = 10 * 60  # How long an API-fetched channel/role is reused
+NEGATIVE_TTL_SECONDS = 5 * 60  # First wait before retrying a channel/role that couldn't be fetched
+MAX_NEGATIVE_TTL_SECONDS = 24 * 60 * 60  # Backoff doubles per failure up to this
+
+CHANNEL = "channel"
+ROLE = "role"
+
+
+class GuildResolver:
+    """
+    Resolves configured channels and roles, going to the API only when needed.
+
+    Lookups try the gateway cache first, then a positive cache of objects
+    fetched from the API. IDs the API answered with NotFound/Forbidden go into
+    a negative cache and aren't fetched again until their backoff expires
+    (doubling per failure), so a guild whose channel or role was deleted
+    doesn't cost an API call on every pass.
+
+    Guilds with a missing channel or role are reported as misconfigured until
+    the ID resolves again or `/setup` calls `clear_guild`.
+    """
+
+    def __init__(self):
+        self._found: dict[tuple[str, int, int], tuple[float, object]] = {}
+        self._missing: dict[tuple[str, int, int], tuple[float, int]] = {}  # -> (retry_at, failures)
+        self._misconfigured: dict[int, dict[str, str]] = {}  # guild_id -> {kind: reason}
+        self.stats = {"api_fetches": 0, "negative_hits": 0}
+
+    # -------------------- Lookups --------------------
+    async def resolve_channel(self, guild: discord.Guild, channel_id: int) -> discord.abc.GuildChannel | None:
+        """The configured channel, or None if it's gone or inaccessible."""
+        return await self._resolve(guild, CHANNEL, channel_id, guild.get_channel, guild.fetch_channel)
+
+    async def resolve_role(self, guild: discord.Guild, role_id: int) -> discord.Role | None:
+        """The configured role, or None if it's gone."""
+        return await self._resolve(guild, ROLE, role_id, guild.get_role, guild.fetch_role)
+
+    async def _resolve(self, guild: discord.Guild, kind: str, object_id: int, get, fetch):
+        key = (kind, guild.id, object_id)
+        now = time.monotonic()
+
+        obj = get(object_id)
+        if obj is None:
+            cached = self._found.get(key)
+            if cached and cached[0] > now:
+                obj = cached[1]
+        if obj is not None:
+            self._mark_resolved(guild, kind, key)
+            return obj
+
+        missing = self._missing.get(key)
+        if missing and missing[0] > now:
+            self.stats["negative_hits"] += 1
+            return None
+
+        self.stats["api_fetches"] += 1
+        try:
+            obj = await fetch(object_id)
+        except (discord.NotFound, discord.Forbidden) as e:
+            failures = (missing[1] if missing else 0) + 1
+            backoff = min(NEGATIVE_TTL_SECONDS * 2 ** (failures - 1), MAX_NEGATIVE_TTL_SECONDS)
+            self._missing[key] = (now + backoff, failures)
+            self._mark_misconfigured(guild, kind, f"{kind} {object_id} is missing or inaccessible ({e.status})")
+            logger.warning(
+                f"❗ Cannot find/access {kind} {object_id} in {guild.name} "
+                f"(attempt {failures}, next try in {backoff // 60} min)"
+            )
+            return None
+        except discord.HTTPException as e:
+            # Not the guild's fault (e.g. a Discord outage): don't cache, just try again next time
+            logger.warning(f"⚠️ Failed to fetch {kind} {object_id} in {guild.name}: {e}")
+            return None
+
+        self._found[key] = (now + POSITIVE_TTL_SECONDS, obj)
+        self._mark_resolved(guild, kind, key)
+        logger.info(f"✅ Fetched {kind} {getattr(obj, 'name', object_id)} via API for {guild.name}")
+        return obj
+
+    # -------------------- Misconfiguration Status --------------------
+    def _mark_misconfigured(self, guild: discord.Guild, kind: str, reason: str):
+        reasons = self._misconfigured.setdefault(guild.id, {})
+        if kind not in reasons:
+            logger.warning(f"🚧 {guild.name} is misconfigured: {reason}. Run /setup to fix it.")
+        reasons[kind] = reason
+
+    def _mark_resolved(self, guild: discord.Guild, kind: str, key: tuple[str, int, int]):
+        self._missing.pop(key, None)
+        reasons = self._misconfigured.get(guild.id)
+        if reasons and reasons.pop(kind, None) is not None:
+            logger.info(f"✅ {guild.name}'s {kind} resolves again.")
+            if not reasons:
+                del self._misconfigured[guild.id]
+
+    def misconfigured_reasons(self, guild_id: int) -> list[str]:
+        """Why a guild is currently considered misconfigured (empty if it isn't)."""
+        return list(self._misconfigured.get(guild_id, {}).values())
+
+    def misconfigured_count(self) -> int:
+        return len(self._misconfigured)
+
+    def clear_guild(self, guild_id: int):
+        """Forgets everything cached for a guild, e.g. after `/setup` changed its channel or role."""
+        for cache in (self._found, self._missing):
+            for key in [key for key in cache if key[1] == guild_id]:
+                del cache[key]
+        self._misconfigured.pop(guild_id, None)
+
+
+resolver = GuildResolver()
@@ -0,0 +1,312 @@
+# scheduler.py
+import asyncio
+import heapq
+import datetime as dt
+from logger import logger
+from resolver import resolver
+from dispatcher import dispatcher
+from utils import pinned_edit_stats, cache_birthday_members
+from tasks import check_and_send_birthdays, midnight_reset, run_guild_pass
+
+# -------------------- Jobs --------------------
+# Job values double as tie-breakers in the heap: when both are due at the same
+# instant for a guild, the midnight reset runs before the birthday check.
+JOB_MIDNIGHT_RESET = 0
+JOB_BIRTHDAY_CHECK = 1
+JOB_NAMES = {
+    JOB_MIDNIGHT_RESET: "midnight reset",
+    JOB_BIRTHDAY_CHECK: "birthday check",
+}
+
+HEARTBEAT_INTERVAL_MINUTES = 30
+
+# A failed job is retried after this delay, doubling per consecutive failure up to the cap
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 60 * 60
+
+
+def _start_of_day(moment: dt.datetime) -> dt.datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class BirthdayScheduler:
+    """
+    Runs each guild's daily jobs at their due time.
+
+    Keeps a heap of (due, guild_id, job) entries and sleeps until the earliest
+    one is due. Entries are invalidated lazily: `_due` holds the current due
+    time of every armed job, and popped entries that no longer match it are
+    dropped. Call `schedule_guild` whenever a guild's config changes or the
+    bot joins it, and `unschedule_guild` when it leaves.
+
+    Due guilds are processed concurrently (see `tasks.run_guild_pass`); a
+    guild's jobs are re-armed once its pass finishes, so passes for the same
+    guild never overlap. A job that fails (or times out) is retried with an
+    exponential backoff instead of at its already-past due time; it only
+    goes back to its daily schedule once it succeeds.
+
+    A guild's jobs only run once the guild is ready, i.e. its birthday members
+    have been loaded into the cache (see `ensure_guild_ready`). At startup
+    guilds are warmed up in the order their jobs come due, and a due guild
+    that hasn't been reached yet is warmed up on the spot.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._heap: list[tuple[dt.datetime, int, int]] = []
+        self._due: dict[tuple[int, int], dt.datetime] = {}
+        self._last_checked: dict[int, dt.date] = {}
+        self._last_reset: dict[int, dt.date] = {}
+        self._reconciled: set[int] = set()
+        self._failures: dict[tuple[int, int], int] = {}
+        self._retry_at: dict[tuple[int, int], dt.datetime] = {}
+        self._wakeup = asyncio.Event()
+        self._running: set[asyncio.Task] = set()
+        self._in_flight: set[int] = set()
+        self._warmups: dict[int, asyncio.Task] = {}
+        self._warmup_task: asyncio.Task | None = None
+        self._all_ready = asyncio.Event()
+
+    # -------------------- Arming --------------------
+    def _arm(self, guild_id: int, job: int, due: dt.datetime):
+        self._due[(guild_id, job)] = due
+        heapq.heappush(self._heap, (due, guild_id, job))
+
+    def _next_check(self, guild_id: int, check_hour: int, now: dt.datetime) -> dt.datetime:
+        due = _start_of_day(now) + dt.timedelta(hours=check_hour)
+        if self._last_checked.get(guild_id) == now.date():
+            due += dt.timedelta(days=1)
+        return due  # May be in the past: the check is then overdue and runs straight away
+
+    def _next_reset(self, guild_id: int, now: dt.datetime) -> dt.datetime:
+        midnight = _start_of_day(now)
+        last_reset = self._last_reset.get(guild_id)
+        if last_reset == now.date():
+            return midnight + dt.timedelta(days=1)
+        if last_reset is not None or now.hour == 0:
+            # A reset was missed while we were down (or it's still the midnight hour): run it now
+            return midnight
+        return midnight + dt.timedelta(days=1)
+
+    async def schedule_guild(self, guild_id: int):
+        """(Re-)arms a guild's jobs from its current config."""
+        if guild_id in self._in_flight:
+            return  # Re-armed from the latest config when the running pass finishes
+
+        config = await self.bot.db.get_guild_config(guild_id)
+        if not config or config.get("check_hour") is None:
+            self.unschedule_guild(guild_id)
+            return
+
+        now = dt.datetime.now(dt.timezone.utc)
+        self._arm(guild_id, JOB_BIRTHDAY_CHECK, self._retry_at.get((guild_id, JOB_BIRTHDAY_CHECK))
+                  or self._next_check(guild_id, int(config["check_hour"]), now))
+        self._arm(guild_id, JOB_MIDNIGHT_RESET, self._retry_at.get((guild_id, JOB_MIDNIGHT_RESET))
+                  or self._next_reset(guild_id, now))
+        self._wakeup.set()
+
+    def unschedule_guild(self, guild_id: int):
+        """Drops a guild's jobs; their heap entries are discarded when popped."""
+        for job in JOB_NAMES:
+            self._due.pop((guild_id, job), None)
+            self._failures.pop((guild_id, job), None)
+            self._retry_at.pop((guild_id, job), None)
+        self._wakeup.set()
+
+    def forget_guild(self, guild_id: int):
+        """Drops a guild the bot has left: its jobs and its readiness."""
+        self.unschedule_guild(guild_id)
+        self._warmups.pop(guild_id, None)
+
+    # -------------------- Readiness --------------------
+    async def ensure_guild_ready(self, guild) -> set[int]:
+        """
+        Loads the guild's birthday members into the cache, once per guild.
+
+        Concurrent and later callers share the same load. Returns the birthday
+        users the gateway reported as no longer in the guild.
+        """
+        task = self._warmups.get(guild.id)
+        if task is None:
+            task = self._warmups[guild.id] = asyncio.create_task(self._warm_up_guild(guild))
+        # Shielded so a caller hitting its time budget doesn't cancel the load for everyone else
+        return set(await asyncio.shield(task))
+
+    def is_guild_ready(self, guild_id: int) -> bool:
+        task = self._warmups.get(guild_id)
+        return task is not None and task.done()
+
+    async def _warm_up_guild(self, guild) -> set[int]:
+        start = dt.datetime.now(dt.timezone.utc)
+        try:
+            missing = await cache_birthday_members(guild, self.bot.db)
+        except Exception as e:
+            # Jobs still run; anyone not loaded here is retried by the jobs themselves
+            logger.error(f"❌ Failed to load birthday members for {guild.name}: {e}", exc_info=True)
+            return set()
+        elapsed = (dt.datetime.now(dt.timezone.utc) - start).total_seconds()
+        logger.info(f"✅ {guild.name} ready ({len(guild.members)} members cached in {elapsed:.2f}s)")
+        return missing
+
+    def _guilds_by_next_due(self) -> list:
+        far_future = dt.datetime.max.replace(tzinfo=dt.timezone.utc)
+
+        def next_due(guild) -> dt.datetime:
+            return min(self._due.get((guild.id, job), far_future) for job in JOB_NAMES)
+
+        return sorted(self.bot.guilds, key=next_due)
+
+    async def _warm_up_all(self, guilds: list):
+        """Readies the given guilds in order (soonest-due jobs first)."""
+        for guild in guilds:
+            if guild.unavailable:
+                continue
+            await self.ensure_guild_ready(guild)
+        self._all_ready.set()
+        logger.info(f"✅ All {len(self.bot.guilds)} guilds ready")
+
+    async def wait_until_all_ready(self):
+        """Waits for the startup warm-up to have readied every guild."""
+        await self._all_ready.wait()
+
+    def _is_current(self, entry: tuple[dt.datetime, int, int]) -> bool:
+        due, guild_id, job = entry
+        return self._due.get((guild_id, job)) == due
+
+    def _pop_due(self, now: dt.datetime) -> list[tuple[int, int]]:
+        jobs = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_current(entry):
+                _, guild_id, job = entry
+                del self._due[(guild_id, job)]
+                jobs.append((guild_id, job))
+        return jobs
+
+    def _next_due(self) -> dt.datetime | None:
+        while self._heap and not self._is_current(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    # -------------------- Running --------------------
+    async def _load_state(self):
+        """Restores each guild's last check/reset dates so a restart doesn't redo finished work."""
+        states = await self.bot.db.get_schedule_states()
+        for guild_id, (last_checked, last_reset) in states.items():
+            if last_checked:
+                self._last_checked[guild_id] = dt.date.fromisoformat(last_checked)
+            if last_reset:
+                self._last_reset[guild_id] = dt.date.fromisoformat(last_reset)
+
+    def _record_success(self, guild_id: int, job: int):
+        self._failures.pop((guild_id, job), None)
+        self._retry_at.pop((guild_id, job), None)
+
+    def _record_failure(self, guild, job: int):
+        """Schedules a retry of a failed job after an exponential backoff."""
+        key = (guild.id, job)
+        failures = self._failures[key] = self._failures.get(key, 0) + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (failures - 1), RETRY_MAX_SECONDS)
+        self._retry_at[key] = dt.datetime.now(dt.timezone.utc) + dt.timedelta(seconds=delay)
+        logger.warning(f"🔁 {JOB_NAMES[job].capitalize()} for {guild.name} didn't complete ({failures}x), retrying in {delay}s")
+
+    async def _run_jobs(self, guild, jobs: list[int], done: set[int]):
+        db = self.bot.db
+        today = dt.datetime.now(dt.timezone.utc).date()
+        for job in jobs:
+            try:
+                if job == JOB_MIDNIGHT_RESET:
+                    # The first reset after startup also sweeps holders that were never tracked
+                    await midnight_reset(self.bot, guild, reconcile=guild.id not in self._reconciled)
+                    self._reconciled.add(guild.id)
+                    self._last_reset[guild.id] = today
+                    await db.set_last_reset_date(guild.id, today.isoformat())
+                else:
+                    if not await check_and_send_birthdays(self.bot, db, guild):
+                        continue  # Some celebrants weren't wished: stays unchecked and is retried
+                    self._last_checked[guild.id] = today
+                    await db.set_last_checked_date(guild.id, today.isoformat())
+                done.add(job)
+            except Exception as e:
+                logger.error(f"❌ Scheduled {JOB_NAMES[job]} failed for {guild.name}: {e}", exc_info=True)
+
+    async def _dispatch(self, guild_id: int, jobs: list[int]):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            logger.debug(f"Guild {guild_id} is no longer available, dropping its jobs.")
+            self.unschedule_guild(guild_id)
+            return
+
+        label = " + ".join(JOB_NAMES[job] for job in jobs).capitalize()
+        done: set[int] = set()
+        self._in_flight.add(guild_id)
+        try:
+            # Don't wish from a half-loaded cache; if the warm-up hasn't reached this guild, it starts now
+            await self.ensure_guild_ready(guild)
+            await run_guild_pass(guild, label, lambda: self._run_jobs(guild, jobs, done))
+        finally:
+            # Jobs that raised or were cut off by the time budget are retried later, not straight away
+            for job in jobs:
+                if job in done:
+                    self._record_success(guild_id, job)
+                else:
+                    self._record_failure(guild, job)
+            self._in_flight.discard(guild_id)
+            await self.schedule_guild(guild_id)
+
+    def _start_due(self, now: dt.datetime):
+        """Starts a task per guild with due jobs; guilds run concurrently, a guild's jobs in order."""
+        by_guild: dict[int, list[int]] = {}
+        for guild_id, job in self._pop_due(now):
+            by_guild.setdefault(guild_id, []).append(job)
+        for guild_id, jobs in by_guild.items():
+            task = asyncio.create_task(self._dispatch(guild_id, sorted(jobs)))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def run(self):
+        """Runs due jobs forever, sleeping until the next one is due."""
+        self._heap.clear()
+        self._due.clear()
+        await self._load_state()
+        for guild in self.bot.guilds:
+            await self.schedule_guild(guild.id)
+        logger.info(f"🕒 Birthday scheduler started with {len(self._due)} jobs for {len(self.bot.guilds)} guilds")
+        if self._warmup_task is None or self._warmup_task.done():
+            # Ordered now, before the first due jobs are popped off the heap
+            self._warmup_task = asyncio.create_task(self._warm_up_all(self._guilds_by_next_due()))
+
+        last_heartbeat = None
+        heartbeat = dt.timedelta(minutes=HEARTBEAT_INTERVAL_MINUTES)
+        while not self.bot.is_closed():
+            # Clear before looking at the heap so re-arms during the jobs below aren't missed
+            self._wakeup.clear()
+            now = dt.datetime.now(dt.timezone.utc)
+
+            self._start_due(now)
+
+            if last_heartbeat is None or now - last_heartbeat >= heartbeat:
+                stats = self.bot.db.config_cache_stats()
+                writes = self.bot.db.write_queue_stats()
+                ready = sum(self.is_guild_ready(guild.id) for guild in self.bot.guilds)
+                logger.info(
+                    f"💓 Birthday scheduler alive at {now.strftime('%Y-%m-%d %H:%M:%S UTC')} "
+                    f"({len(self._due)} jobs armed, {ready} guilds ready; config cache: {stats['hits']} hits, {stats['misses']} misses; "
+                    f"pinned edits: {pinned_edit_stats['edited']} made, {pinned_edit_stats['skipped']} skipped; "
+                    f"db writes: {writes['writes']} in {writes['flushes']} commits, "
+                    f"avg batch {writes['avg_batch']:.1f}, avg latency {writes['avg_latency_ms']:.1f}ms; "
+                    f"misconfigured guilds: {resolver.misconfigured_count()}; "
+                    f"sent {dispatcher.stats['messages']} messages and {dispatcher.stats['role_grants']} role grants, "
+                    f"throttled {dispatcher.stats['throttled_seconds']:.1f}s)"
+                )
+                last_heartbeat = now
+
+            next_due = self._next_due()
+            now = dt.datetime.now(dt.timezone.utc)
+            timeout = heartbeat.total_seconds()
+            if next_due is not None:
+                timeout = max(0.0, min(timeout, (next_due - now).total_seconds()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -1,232 +1,279 @@
 import asyncio
+import time
 import discord
 import datetime as dt
+from config import MAX_CONCURRENT_GUILD_PASSES, GUILD_PASS_TIMEOUT_SECONDS
+from dispatcher import dispatcher, chunk_members
 from logger import logger
-from utils import update_pinned_birthday_message, is_birthday_on_date
+from resolver import resolver
+from utils import cache_birthday_members
 
 # -------------------- Globals --------------------
-already_logged_missing_roles_remove = set()
-already_logged_missing_roles_add = set()
+guild_pass_semaphore = asyncio.Semaphore(MAX_CONCURRENT_GUILD_PASSES)
+
+BIRTHDAY_MESSAGE = (
+    "🎉 Happy Birthday, {mention}! 🎈\n"
+    "From all of us at **{guild}**, sending you lots of love today 💖🎂"
+)
+COMBINED_BIRTHDAY_MESSAGE = (
+    "🎉 Happy Birthday, {mentions}! 🎈\n"
+    "From all of us at **{guild}**, sending you all lots of love today 💖🎂"
+)
+
+# -------------------- Guild Passes --------------------
+async def run_guild_pass(guild: discord.Guild, label: str, pass_fn) -> bool:
+    """
+    Run one guild's pass under the shared concurrency limit and time budget.
+
+    Errors and timeouts are logged rather than raised so one broken guild
+    can't hold up or take down the others. Returns True if the pass completed.
+    """
+    async with guild_pass_semaphore:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(pass_fn(), timeout=GUILD_PASS_TIMEOUT_SECONDS)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ {label} for {guild.name} exceeded {GUILD_PASS_TIMEOUT_SECONDS}s and was cancelled")
+        except Exception as e:
+            logger.error(f"❌ {label} failed for {guild.name}: {e}", exc_info=True)
+        finally:
+            logger.info(f"⏱️ {label} for {guild.name} took {time.perf_counter() - start:.2f}s")
+        return False
+
+async def run_guild_passes(guilds: list[discord.Guild], label: str, pass_fn):
+    """Run pass_fn(guild) for every guild concurrently via run_guild_pass."""
+    await asyncio.gather(*(
+        run_guild_pass(guild, label, lambda guild=guild: pass_fn(guild))
+        for guild in guilds
+    ))
 
 # -------------------- Wished Table --------------------
-async def ensure_wished_table(db):
-    """Ensure wished_today table exists."""
-    logger.debug("Ensuring wished_today table exists in DB...")
-    await db.db.execute("""
-        CREATE TABLE IF NOT EXISTS wished_today (
-            guild_id TEXT NOT NULL,
-            user_id TEXT NOT NULL,
-            date TEXT NOT NULL,
-            PRIMARY KEY (guild_id, user_id, date)
-        )
-    """)
-    await db.db.commit()
-    logger.debug("✅ wished_today table check complete.")
-
-async def has_been_wished(db, guild_id: str, user_id: str, date_str: str) -> bool:
-    async with db.db.execute(
-        "SELECT 1 FROM wished_today WHERE guild_id = ? AND user_id = ? AND date = ?",
-        (guild_id, user_id, date_str)
-    ) as cursor:
-        result = await cursor.fetchone()
-        logger.debug(f"has_been_wished? guild={guild_id}, user={user_id}, date={date_str} -> {bool(result)}")
-        return result is not None
-
-async def mark_as_wished(db, guild_id: str, user_id: str, date_str: str):
-    logger.debug(f"Marking user {user_id} as wished in guild {guild_id} for {date_str}")
-    await db.db.execute(
-        "INSERT OR IGNORE INTO wished_today (guild_id, user_id, date) VALUES (?, ?, ?)",
-        (guild_id, user_id, date_str)
-    )
-    await db.db.commit()
-
 async def clear_old_wishes(db, retain_days: int = 7):
     """Delete wished_today entries older than retain_days."""
     today = dt.datetime.now(dt.timezone.utc)
     cutoff_date = (today - dt.timedelta(days=retain_days)).strftime("%Y-%m-%d")
     logger.info(f"🧹 Clearing wished_today entries older than {cutoff_date}")
-    await db.db.execute("DELETE FROM wished_today WHERE date < ?", (cutoff_date,))
-    await db.db.commit()
+    await db.clear_wished_before(cutoff_date)
     logger.debug("✅ Old wishes cleared.")
 
 # -------------------- Birthday Check --------------------
-async def check_and_send_birthdays(bot, db, guild: discord.Guild, today_override: dt.datetime = None, ignore_wished: bool = False):
+async def check_and_send_birthdays(bot, db, guild: discord.Guild, today_override: dt.datetime = None, ignore_wished: bool = False) -> bool:
+    """Wish today's celebrants. Returns False if some couldn't be loaded, so the check has to run again."""
     guild_name = guild.name
-    guild_id = str(guild.id)
     logger.info(f"🔍 Checking birthdays for guild {guild_name}...")
 
-    config = await db.get_guild_config(guild_id)
+    config = await db.get_guild_config(guild.id)
     if not config:
         logger.warning(f"❗ No config found for guild {guild_name} — skipping.")
-        return
+        return True
 
     # Resolve channel
     channel_id = config.get("channel_id")
     if not channel_id:
         logger.warning(f"❗ No channel ID set for {guild_name}.")
-        return
+        return True
 
-    channel = guild.get_channel(int(channel_id)) or await guild.fetch_channel(int(channel_id))
+    channel = await resolver.resolve_channel(guild, channel_id)
+    if channel is None:
+        logger.debug(f"Birthday channel of {guild_name} is unavailable, skipping check.")
+        return True
     perms = channel.permissions_for(guild.me)
     if not perms.send_messages:
         logger.error(f"Cannot send messages in channel {channel.name} ({channel.id})")
-        return
+        return True
 
-    # Resolve birthday role
+    # Resolve birthday role (a missing one only skips role assignment)
     role_id = config.get("birthday_role_id")
-    role = None
-    if role_id:
-        try:
-            role_id_str = str(role_id)
-            role = guild.get_role(int(role_id_str))
-            if not role and str(guild.id) not in already_logged_missing_roles_add:
-                try:
-                    role = await guild.fetch_role(int(role_id_str))
-                    logger.info(f"✅ Fetched birthday role {role.name} via API for {guild_name}")
-                except Exception as e:
-                    logger.warning(f"❗ Cannot find/access birthday role {role_id_str} in {guild_name}: {e}")
-                    already_logged_missing_roles_add.add(str(guild.id))
-        except (TypeError, ValueError):
-            logger.warning(f"❗ Invalid birthday role ID in {guild_name}, skipping role assignment.")
+    role = await resolver.resolve_role(guild, role_id) if role_id else None
 
     now = today_override or dt.datetime.now(dt.timezone.utc)
     date_str = now.strftime("%Y-%m-%d")
 
-    birthdays = await db.get_birthdays(guild_id)
-    logger.info(f"📋 Found {len(birthdays)} birthday entries in DB for {guild_name}")
+    celebrants = db.get_todays_celebrants(guild.id, now.date())
+    logger.info(f"📋 Found {len(celebrants)} birthdays today for {guild_name}")
     todays_birthdays = []
+    role_holders = []
+    already_wished = set() if ignore_wished else await db.get_wished_users(guild.id, date_str)
+
+    pending = [user_id for user_id in celebrants if user_id not in already_wished]
+    gone = await cache_birthday_members(guild, db, pending)
+    members = [member for member in map(guild.get_member, pending) if member]
+    # Celebrants who left the guild have nothing to send; they only get marked as wished
+    todays_birthdays.extend(gone)
+    unknown = len(pending) - len(members) - len(gone)
+    if unknown:
+        # Couldn't be loaded: left unmarked so the retried check wishes them
+        logger.warning(f"❗ Could not load {unknown} celebrants in {guild_name}, the check will be retried")
 
-    sent_this_loop = set()
-    for user_id, birthday in birthdays:
-        user_id = str(user_id)
-        if user_id in sent_this_loop:
-            continue
-
-        if is_birthday_on_date(birthday, now):
-            if not ignore_wished and await has_been_wished(db, guild_id, user_id, date_str):
-                continue
-
-            todays_birthdays.append(user_id)
-            sent_this_loop.add(user_id)
-
-            member = guild.get_member(int(user_id))
-            if member:
+    try:
+        if config.get("combine_announcements"):
+            # One message for everyone (split only if it would exceed Discord's length limit)
+            reserved = len(COMBINED_BIRTHDAY_MESSAGE.format(mentions="", guild=guild_name))
+            for chunk in chunk_members(members, reserved):
+                # A lone celebrant gets the personal wording rather than "you all"
+                content = (
+                    BIRTHDAY_MESSAGE.format(mention=chunk[0].mention, guild=guild_name) if len(chunk) == 1
+                    else COMBINED_BIRTHDAY_MESSAGE.format(
+                        mentions=", ".join(member.mention for member in chunk), guild=guild_name
+                    )
+                )
+                try:
+                    await dispatcher.send(channel, content, mentions=chunk)
+                    logger.info(f"✅ Sent combined birthday message for {len(chunk)} members in {guild_name}")
+                except Exception as e:
+                    logger.error(f"❌ Failed to send combined birthday message in {guild_name}: {e}")
+                todays_birthdays.extend(member.id for member in chunk)
+        else:
+            for member in members:
                 try:
-                    await channel.send(
-                        f"🎉 Happy Birthday, {member.mention}! 🎈\n"
-                        f"From all of us at **{guild_name}**, sending you lots of love today 💖🎂"
+                    await dispatcher.send(
+                        channel,
+                        BIRTHDAY_MESSAGE.format(mention=member.mention, guild=guild_name),
+                        mentions=[member],
                     )
                     logger.info(f"✅ Sent birthday message for {member.display_name} in {guild_name}")
                 except Exception as e:
                     logger.error(f"❌ Failed to send birthday message for {member.display_name} in {guild_name}: {e}")
-
-                if role and role not in member.roles:
-                    try:
-                        await member.add_roles(role, reason="Birthday!")
-                        logger.info(f"✅ Added birthday role to {member.display_name} in {guild_name}")
-                    except Exception as e:
-                        logger.warning(f"❗ Could not add birthday role to {member.display_name}: {e}")
-
-            if not ignore_wished:
-                await mark_as_wished(db, guild_id, user_id, date_str)
+                todays_birthdays.append(member.id)
+
+        if role:
+            role_holders.extend(member.id for member in members if role in member.roles)
+            await dispatcher.add_roles(
+                [member for member in members if role not in member.roles],
+                role,
+                reason="Birthday!",
+                on_granted=lambda member: role_holders.append(member.id),
+            )
+            logger.info(f"✅ Birthday role held by {len(role_holders)} members in {guild_name}")
+    finally:
+        # Record whoever was handled, even if the pass was interrupted part-way
+        if not ignore_wished:
+            await db.mark_users_as_wished(guild.id, todays_birthdays, date_str)
+        if role:
+            granted_at = dt.datetime.now(dt.timezone.utc).isoformat()
+            await db.record_role_grants(guild.id, role.id, role_holders, granted_at)
 
     # Update pinned message
     try:
-        await update_pinned_birthday_message(guild, db=db, highlight_today=todays_birthdays)
+        await bot.pinned_refresh.refresh_now(guild)
         logger.info(f"📌 Pinned message updated for {guild_name}")
     except Exception as e:
         logger.error(f"❌ Failed to update pinned message for {guild_name}: {e}")
+    return not unknown
 
 # -------------------- Remove Birthday Roles --------------------
-async def remove_birthday_roles(db, guild: discord.Guild):
-    config = await db.get_guild_config(str(guild.id))
+async def remove_birthday_roles(db, guild: discord.Guild, reconcile: bool = False):
+    """
+    Take the birthday role back from the members it was given to before today.
+
+    Only the tracked holders are touched. With reconcile=True, anyone else
+    holding the role (e.g. given it by hand or before grants were tracked)
+    loses it too, except members who were granted it today.
+    """
+    config = await db.get_guild_config(guild.id)
     role = None
     if config and config.get("birthday_role_id"):
-        try:
-            role_id_str = str(config["birthday_role_id"])
-            role = guild.get_role(int(role_id_str))
-            if not role and str(guild.id) not in already_logged_missing_roles_remove:
-                logger.warning(f"❗ Birthday role {role_id_str} not found in {guild.name}. Skipping removal.")
-                already_logged_missing_roles_remove.add(str(guild.id))
-        except (TypeError, ValueError):
-            logger.warning(f"❗ Invalid birthday role ID in {guild.name}, skipping removal.")
+        role = await resolver.resolve_role(guild, config["birthday_role_id"])
+
+    today_str = dt.datetime.now(dt.timezone.utc).strftime("%Y-%m-%d")
+    grants = await db.get_role_grants(guild.id)
+    # ISO timestamps compare correctly against a bare date string
+    expired = [user_id for user_id, _, granted_at in grants if granted_at < today_str]
+    granted_today = {user_id for user_id, _, granted_at in grants if granted_at >= today_str}
 
     if role:
-        for member in guild.members:
-            if role in member.roles:
-                try:
-                    await member.remove_roles(role, reason="Birthday day ended")
-                except Exception as e:
-                    logger.error(f"❌ Error removing birthday role from {member.display_name}: {e}")
+        await cache_birthday_members(guild, db, expired)
+        members = [guild.get_member(user_id) for user_id in expired]
+        if reconcile:
+            tracked = {user_id for user_id, _, _ in grants}
+            members += [member for member in role.members if member.id not in tracked]
+
+        for member in members:
+            if member is None or member.id in granted_today or role not in member.roles:
+                continue
+            try:
+                await member.remove_roles(role, reason="Birthday day ended")
+            except Exception as e:
+                logger.error(f"❌ Error removing birthday role from {member.display_name}: {e}")
+
+    # Expired grants are dropped even if removal failed or the member/role is gone, so they don't pile up
+    await db.delete_role_grants(guild.id, expired)
+
+# -------------------- Midnight Reset --------------------
+async def midnight_reset(bot, guild: discord.Guild, reconcile: bool = False):
+    """Remove yesterday's birthday roles and refresh the pinned list for a new UTC day."""
+    await remove_birthday_roles(bot.db, guild, reconcile=reconcile)
+    try:
+        # Manual once a day, so a deleted or unpinned list comes back even if its text didn't change
+        await bot.pinned_refresh.refresh_now(guild, manual=True)
+        logger.info(f"📌 Pinned message refreshed in {guild.name}")
+    except Exception as e:
+        logger.error(f"❌ Failed to refresh pinned message for {guild.name}: {e}")
+
+# -------------------- Reconciliation --------------------
+async def reconcile_stored_data(bot) -> int:
+    """
+    Purge data the bot can no longer use: birthdays (plus wished/role-grant
+    rows) of members who left while the bot was offline, and everything stored
+    for guilds the bot is no longer in.
+
+    Departed members are the birthday users the gateway reported as absent
+    when the guild was readied (see BirthdayScheduler.ensure_guild_ready),
+    checked once more right before purging in case they have rejoined since.
+    Returns the number of rows reclaimed.
+    """
+    db = bot.db
+    # Let the scheduler ready guilds in due order rather than competing with it
+    await bot.scheduler.wait_until_all_ready()
+    member_rows = departed_members = 0
+    for guild in bot.guilds:
+        if guild.unavailable:
+            continue
+        candidates = await bot.scheduler.ensure_guild_ready(guild) & db.birthday_user_ids(guild.id)
+        if not candidates:
+            continue
+        # The warm-up may be minutes old: anyone who rejoined since keeps their data
+        departed = await cache_birthday_members(guild, db, list(candidates))
+        departed = {user_id for user_id in departed if guild.get_member(user_id) is None}
+        if not departed:
+            continue
+        member_rows += await db.purge_members(guild.id, list(departed))
+        departed_members += len(departed)
+        bot.pinned_refresh.mark_dirty(guild)
+        logger.info(f"🧹 Removed {len(departed)} birthdays of members who left {guild.name} while offline")
+
+    guild_rows = 0
+    departed_guilds = await db.get_stored_guild_ids() - {guild.id for guild in bot.guilds}
+    for guild_id in departed_guilds:
+        guild_rows += await db.purge_guild(guild_id)
+        bot.scheduler.unschedule_guild(guild_id)
+
+    logger.info(
+        f"🧹 Reconciliation reclaimed {member_rows + guild_rows} rows: {member_rows} from "
+        f"{departed_members} departed members, {guild_rows} from {len(departed_guilds)} departed guilds"
+    )
+    return member_rows + guild_rows
 
 # -------------------- Birthday Check Loop --------------------
-async def birthday_check_loop(bot: discord.Client, interval_minutes: int = 5):
+async def birthday_check_loop(bot: discord.Client):
+    """Prepare the DB and hand over to the bot's scheduler, which wakes only when a job is due."""
     db = bot.db
-    await ensure_wished_table(db)
     await clear_old_wishes(db)
-    logger.info(f"🕒 Birthday check loop started (every {interval_minutes} minutes)")
-
-    last_reset_date = None
-    already_checked_guilds = set()
-    last_heartbeat = None
-    HEARTBEAT_INTERVAL = 30
-
-    await asyncio.sleep(5)
-
-    while True:
-        now = dt.datetime.now(dt.timezone.utc)
-        today_str = now.strftime("%Y-%m-%d")
-        current_hour = now.hour
-
-        # Role reset + pinned refresh at UTC midnight
-        if last_reset_date != today_str and now.hour == 0:
-            logger.info("🌙 Midnight UTC reached. Removing birthday roles and refreshing pinned messages.")
-            for guild in bot.guilds:
-                await remove_birthday_roles(db, guild)
-                try:
-                    await update_pinned_birthday_message(guild, db=db)
-                    logger.info(f"📌 Pinned message refreshed in {guild.name}")
-                except Exception as e:
-                    logger.error(f"❌ Failed to refresh pinned message for {guild.name}: {e}")
-            last_reset_date = today_str
-            already_checked_guilds.clear()
-
-        # Birthday wishes (respect check_hour)
-        for guild in bot.guilds:
-            config = await db.get_guild_config(str(guild.id))
-            if not config or "check_hour" not in config:
-                continue
-
-            check_hour = int(config["check_hour"])
-            if guild.id in already_checked_guilds:
-                continue
-
-            if current_hour >= check_hour:
-                await check_and_send_birthdays(bot, db, guild)
-                already_checked_guilds.add(guild.id)
-
-        # Heartbeat logging
-        if last_heartbeat is None or (now - last_heartbeat).total_seconds() >= HEARTBEAT_INTERVAL * 60:
-            logger.info(f"💓 Birthday check loop alive at {now.strftime('%Y-%m-%d %H:%M:%S UTC')}")
-            last_heartbeat = now
-
-        await asyncio.sleep(interval_minutes * 60)
+    await bot.scheduler.run()
 
 # -------------------- Run Once for Test --------------------
 async def run_birthday_check_once(bot, guild: discord.Guild = None, test_date: dt.datetime = None, reset_wished: bool = False):
     db = bot.db
-    await ensure_wished_table(db)
     date_str = (test_date or dt.datetime.now(dt.timezone.utc)).strftime("%Y-%m-%d")
 
     if reset_wished and guild:
-        await db.db.execute(
-            "DELETE FROM wished_today WHERE guild_id = ? AND date = ?",
-            (str(guild.id), date_str)
-        )
-        await db.db.commit()
+        await db.clear_wished(guild.id, date_str)
         logger.info(f"🗑️ Cleared wished users for {guild.name} (test run)")
 
-    targets = [guild] if guild else bot.guilds
-    for g in targets:
-        await remove_birthday_roles(db, g)
+    async def test_pass(g: discord.Guild):
+        await remove_birthday_roles(db, g, reconcile=True)
         await check_and_send_birthdays(bot, db, g, today_override=test_date)
+
+    targets = [guild] if guild else bot.guilds
+    await run_guild_passes(targets, "Test birthday check", test_pass)
@@ -0,0 +1,94 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+
+import utils
+from database import Database
+
+
+class FakeMessage:
+    def __init__(self, channel, message_id, content):
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+        self.pinned = False
+
+    async def edit(self, content=None, view=None, **kwargs):
+        if self.id not in self.channel.messages:
+            raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+        self.channel.messages[self.id].content = content
+        return self.channel.messages[self.id]
+
+    async def pin(self):
+        self.channel.messages[self.id].pinned = True
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = "birthdays"
+        self.messages: dict[int, FakeMessage] = {}
+
+    def permissions_for(self, member):
+        return SimpleNamespace(send_messages=True, manage_messages=True)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self, message_id, None)
+
+    async def send(self, content=None, view=None, **kwargs):
+        message = FakeMessage(self, len(self.messages) + 1000, content)
+        self.messages[message.id] = message
+        return message
+
+
+class FakeGuild:
+    def __init__(self, guild_id, channel):
+        self.id = guild_id
+        self.name = "guild"
+        self.me = None
+        self._channel = channel
+
+    def get_channel(self, channel_id):
+        return self._channel if channel_id == self._channel.id else None
+
+    def get_member(self, user_id):
+        return None
+
+    async def fetch_channel(self, channel_id):
+        raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Channel")
+
+
+def test_manual_refresh_resends_a_deleted_list(tmp_path):
+    async def scenario():
+        db = Database(str(tmp_path / "birthdays.db"))
+        await db.connect()
+        try:
+            await db.init_db()
+            channel = FakeChannel(10)
+            guild = FakeGuild(1, channel)
+            await db.set_guild_config(guild.id, channel.id, None, None, 9)
+            await db.set_birthday(guild.id, 5, "03-01", display_name="someone")
+
+            first = await utils.update_pinned_birthday_message(guild, db)
+            assert first.pinned and len(channel.messages) == 1
+
+            # A moderator deletes the list; its text hasn't changed since
+            channel.messages.clear()
+            utils.pinned_edit_stats.update(edited=0, skipped=0)
+
+            pinned = await utils.update_pinned_birthday_message(guild, db, manual=True)
+            assert isinstance(pinned, FakeMessage)
+            assert len(channel.messages) == 1 and pinned.pinned
+            assert utils.pinned_edit_stats["skipped"] == 0
+
+            # Unpinned but still there: a manual refresh pins it again
+            pinned.pinned = False
+            repinned = await utils.update_pinned_birthday_message(guild, db, manual=True)
+            assert repinned.id == pinned.id and repinned.pinned
+        finally:
+            await db.close()
+            utils._pinned_handles.clear()
+            utils._pinned_hashes.clear()
+
+    asyncio.run(scenario())
@@ -1,19 +1,30 @@
-import calendar
+import asyncio
+import hashlib
 import discord
 import datetime as dt
+import birthday_calendar
 from logger import logger
+from resolver import resolver
 from discord.ui import View, Button
 
 MAX_PINNED_ENTRIES = 20  # Show first 20 in pinned message
 CONFETTI_ICON = "🎉 "
 
+# Pinned message edits performed vs skipped because the rendered content was unchanged
+pinned_edit_stats = {"edited": 0, "skipped": 0}
+# Per-guild pinned message handle and the content hash it was last rendered with
+_pinned_handles: dict[int, discord.PartialMessage] = {}
+_pinned_hashes: dict[int, str | None] = {}
+# Per-guild sorted birthday pages and their rendered text, valid for one UTC date
+_page_cache: dict[int, dict] = {}
+
 
 def parse_day_month_input(day_input, month_input):
-    """Parse user input for day and month into integers."""
+    """Parse user input for day and month into integers, rejecting dates that don't exist (e.g. 31/02)."""
     try:
         day = int(day_input)
         month = int(month_input)
-        if 1 <= day <= 31 and 1 <= month <= 12:
+        if birthday_calendar.birthday_slot(f"{month:02d}-{day:02d}") is not None:
             return day, month
     except ValueError:
         pass
@@ -22,207 +33,342 @@ def parse_day_month_input(day_input, month_input):
 
 def format_birthday_display(birthday_str):
     """Convert 'MM-DD' into a readable format with suffix."""
-    try:
-        month_str, day_str = birthday_str.split("-")
-        month, day = int(month_str), int(day_str)
-        month_name = calendar.month_name[month]
-
-        if 4 <= day <= 20 or 24 <= day <= 30:
-            suffix = "th"
-        else:
-            suffix = ["st", "nd", "rd"][(day % 10) - 1] if 1 <= day % 10 <= 3 else "th"
-
-        return f"{day}{suffix} {month_name}"
-    except Exception as e:
-        logger.error(f"Error formatting birthday '{birthday_str}': {e}")
+    display = birthday_calendar.display(birthday_str)
+    if display is None:
+        logger.error(f"Error formatting birthday '{birthday_str}': not a valid MM-DD date")
         return birthday_str
+    return display
 
 
 def is_birthday_on_date(birthday_str: str, check_date: dt.datetime) -> bool:
     """Check if a birthday occurs on the given date (handles Feb 29)."""
-    b_month, b_day = map(int, birthday_str.split("-"))
-    if b_month == 2 and b_day == 29:
-        is_leap_year = (check_date.year % 4 == 0 and (check_date.year % 100 != 0 or check_date.year % 400 == 0))
-        return (check_date.month == 2 and check_date.day == 29 and is_leap_year) or \
-               (check_date.month == 2 and check_date.day == 28 and not is_leap_year)
-    return check_date.month == b_month and check_date.day == b_day
-
-
-# ---------------- Pagination View ----------------
-class BirthdayPages(discord.ui.View):
-    def __init__(self, pages: list[list[tuple[str, str]]], guild: discord.Guild, check_hour: int):
-        super().__init__(timeout=None)
-        self.pages = pages
-        self.guild = guild
-        self.check_hour = check_hour
-        self.current = 0
-
-        if len(self.pages) > 1:
-            self.previous_button = Button(label="⬅️", style=discord.ButtonStyle.primary, disabled=True)
-            self.next_button = Button(label="➡️", style=discord.ButtonStyle.primary)
-            self.previous_button.callback = self.previous
-            self.next_button.callback = self.next
-            self.add_item(self.previous_button)
-            self.add_item(self.next_button)
-        else:
-            self.previous_button = None
-            self.next_button = None
-
-    async def update_message(self, interaction: discord.Interaction):
-        if self.previous_button and self.next_button:
-            self.previous_button.disabled = self.current == 0
-            self.next_button.disabled = self.current >= len(self.pages) - 1
-
-        today = dt.datetime.now(dt.timezone.utc)
-        page_content = []
-        for user_id, birthday in self.pages[self.current]:
-            member = self.guild.get_member(int(user_id))
-            name = member.display_name if member else f"<@{user_id}>"
-            prefix = "・" + (CONFETTI_ICON if is_birthday_on_date(birthday, today) else "")
-            page_content.append(f"{prefix}{name} - {format_birthday_display(birthday)}")
-
-        content = "🎂 BIRTHDAY LIST 🎂\n------------------------\n"
-        content += "\n".join(page_content)
-        content += "\n\n"
-        content += "-# 💡 Tip: Use /setbirthday to add your own special day!\n"
-        content += f"-# ⏰ Bot checks birthdays daily at {self.check_hour}:00 UTC"
-        if len(self.pages) > 1:
-            content += f"\n\nPage {self.current + 1}/{len(self.pages)}"
+    slot = birthday_calendar.birthday_slot(birthday_str)
+    return slot is not None and birthday_calendar.is_celebrated_on(slot, check_date)
+
+
+# ---------------- Member Cache ----------------
+MEMBER_QUERY_BATCH = 100  # Most user IDs the gateway accepts per member request
+
 
+async def cache_birthday_members(guild: discord.Guild, db, user_ids=None) -> set[int]:
+    """
+    Make sure members with birthdays are cached, fetching only the missing ones.
+
+    The bot doesn't chunk whole guilds; it caches just the users it needs
+    (everyone with a birthday, or only `user_ids`) and refreshes their name
+    snapshots on the way. Bots found this way (e.g. from an import) have their
+    birthday deleted. Returns the IDs the gateway reported as not being in the
+    guild. Batches that fail count as unknown, not missing.
+    """
+    user_ids = db.birthday_user_ids(guild.id) if user_ids is None else user_ids
+    uncached = [user_id for user_id in user_ids if guild.get_member(user_id) is None]
+    missing = set()
+    bots = []
+    for i in range(0, len(uncached), MEMBER_QUERY_BATCH):
+        batch = uncached[i:i + MEMBER_QUERY_BATCH]
         try:
-            await interaction.response.edit_message(content=content, view=self)
+            members = await guild.query_members(user_ids=batch, cache=True)
+        except (asyncio.TimeoutError, discord.ClientException) as e:
+            logger.warning(f"⚠️ Could not load {len(batch)} birthday members in {guild.name}: {e}")
+            continue
+        for member in members:
+            if member.bot:
+                bots.append(member.id)
+            else:
+                await db.update_display_name(guild.id, member.id, member.display_name)
+        missing.update(set(batch) - {member.id for member in members})
+    if bots:
+        # Bots don't get wished or listed, so their rows are dropped rather than kept around
+        await db.delete_birthdays(guild.id, bots)
+        logger.info(f"🤖 Removed {len(bots)} bot birthdays in {guild.name}")
+    if uncached:
+        logger.debug(f"Cached {len(uncached) - len(missing)} birthday members in {guild.name} ({len(missing)} gone)")
+    return missing
+
+
+# ---------------- Birthday Pages ----------------
+async def load_birthday_pages(guild: discord.Guild, db) -> list[list[tuple[int, str, str | None]]]:
+    """Sort a guild's birthdays by how soon they come up and split them into pages of (user_id, birthday, name snapshot)."""
+    birthdays = [
+        (user_id, birthday, db.display_name(guild.id, user_id))
+        for user_id, birthday in await db.get_birthdays(guild.id)
+    ]
+    sorted_birthdays = birthday_calendar.upcoming_order(birthdays, dt.datetime.now(dt.timezone.utc).date())
+    return [sorted_birthdays[i:i + MAX_PINNED_ENTRIES] for i in range(0, len(sorted_birthdays), MAX_PINNED_ENTRIES)]
+
+
+def render_birthday_page(guild: discord.Guild, pages: list[list[tuple[int, str, str | None]]], index: int, check_hour: int) -> str:
+    """Render one page of the birthday list."""
+    today = dt.datetime.now(dt.timezone.utc)
+    page_content = []
+    for user_id, birthday, snapshot_name in pages[index]:
+        # Only birthday users are cached, and only once loaded; the stored snapshot covers the rest
+        member = guild.get_member(user_id)
+        name = member.display_name if member else snapshot_name or f"<@{user_id}>"
+        prefix = "・" + (CONFETTI_ICON if is_birthday_on_date(birthday, today) else "")
+        page_content.append(f"{prefix}{name} - {format_birthday_display(birthday)}")
+
+    content = "🎂 BIRTHDAY LIST 🎂\n------------------------\n"
+    content += "\n".join(page_content)
+    content += "\n\n"
+    content += "-# 💡 Tip: Use /setbirthday to add your own special day!\n"
+    content += f"-# ⏰ Bot checks birthdays daily at {check_hour}:00 UTC"
+    if len(pages) > 1:
+        content += f"\n\nPage {index + 1}/{len(pages)}"
+    return content
+
+
+# ---------------- Page Cache ----------------
+async def get_birthday_pages(guild: discord.Guild, db) -> list[list[tuple[int, str, str | None]]]:
+    """
+    Return the guild's sorted pages from the cache.
+
+    They are reloaded when the guild's birthdays changed since they were built
+    or when they were built on an earlier UTC date (the order depends on today).
+    """
+    today = dt.datetime.now(dt.timezone.utc).date()
+    revision = db.birthday_revision(guild.id)
+    cached = _page_cache.get(guild.id)
+    if cached is None or cached["date"] != today or cached["revision"] != revision:
+        pages = await load_birthday_pages(guild, db)
+        cached = {"date": today, "revision": revision, "pages": pages, "check_hour": None, "rendered": {}}
+        _page_cache[guild.id] = cached
+    return cached["pages"]
+
+
+async def get_rendered_page(guild: discord.Guild, db, index: int, check_hour: int) -> tuple[str, int]:
+    """Return (content, page_count) for a page, rendering it only on first use."""
+    pages = await get_birthday_pages(guild, db)
+    cached = _page_cache[guild.id]
+    if cached["check_hour"] != check_hour:
+        cached["check_hour"] = check_hour
+        cached["rendered"].clear()
+    if index not in cached["rendered"]:
+        cached["rendered"][index] = render_birthday_page(guild, pages, index, check_hour)
+    return cached["rendered"][index], len(pages)
+
+
+# ---------------- Pagination Buttons ----------------
+class BirthdayPageButton(
+    discord.ui.DynamicItem[Button],
+    template=r"birthday_pages:(?P<guild_id>[0-9]+):(?P<page>[0-9]+):(?P<direction>prev|next)"
+):
+    """
+    Persistent page button for pinned birthday lists.
+
+    The custom_id carries the guild and the page to show, so one registration
+    at startup (`bot.add_dynamic_items`) serves every pinned message, including
+    ones sent before a restart. Nothing is kept per message.
+    """
+
+    def __init__(self, guild_id: int, page: int, direction: str, disabled: bool = False):
+        super().__init__(
+            Button(
+                label="⬅️" if direction == "prev" else "➡️",
+                style=discord.ButtonStyle.primary,
+                custom_id=f"birthday_pages:{guild_id}:{page}:{direction}",
+                disabled=disabled,
+            )
+        )
+        self.guild_id = guild_id
+        self.page = page
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: Button, match):
+        return cls(int(match["guild_id"]), int(match["page"]), match["direction"])
+
+    async def callback(self, interaction: discord.Interaction):
+        guild = interaction.guild
+        db = interaction.client.db
+        if guild is None or guild.id != self.guild_id:
+            # Still acknowledged, so the user doesn't get "This interaction failed"
+            await interaction.response.defer()
+            return
+
+        guild_config = await db.get_guild_config(guild.id)
+        check_hour = guild_config.get("check_hour", 9) if guild_config else 9
+        pages = await get_birthday_pages(guild, db)
+        if not pages:
+            await interaction.response.defer()
+            return
+
+        page = min(self.page, len(pages) - 1)
+        content, page_count = await get_rendered_page(guild, db, page, check_hour)
+        view = birthday_page_view(guild.id, page, page_count)
+
+        # The pinned message no longer shows page 1, so the next refresh must edit it (after a restart too).
+        # None means the stored hash is already blank; no entry means it hasn't been read since startup.
+        if guild.id not in _pinned_hashes or _pinned_hashes[guild.id] is not None:
+            _pinned_hashes[guild.id] = None
+            await db.set_config_value(f"pinned_birthday_hash_{guild.id}", "", durable=False)
+        try:
+            await interaction.response.edit_message(content=content, view=view)
         except discord.InteractionResponded:
-            await interaction.edit_original_response(content=content, view=self)
+            await interaction.edit_original_response(content=content, view=view)
 
-    async def previous(self, interaction: discord.Interaction):
-        if self.current > 0:
-            self.current -= 1
-        await self.update_message(interaction)
 
-    async def next(self, interaction: discord.Interaction):
-        if self.current < len(self.pages) - 1:
-            self.current += 1
-        await self.update_message(interaction)
+def birthday_page_view(guild_id: int, page: int, page_count: int) -> View | None:
+    """Build the prev/next buttons for a page, or None when there's only one page."""
+    if page_count <= 1:
+        return None
+    view = View(timeout=None)
+    view.add_item(BirthdayPageButton(guild_id, max(page - 1, 0), "prev", disabled=page == 0))
+    view.add_item(BirthdayPageButton(guild_id, min(page + 1, page_count - 1), "next", disabled=page >= page_count - 1))
+    return view
 
 
 # ---------------- Update Pinned Birthday Message ----------------
 async def update_pinned_birthday_message(
     guild: discord.Guild,
     db,
-    highlight_today: list[str] = None,
     manual: bool = False
-) -> discord.Message | None:
-    """Update (or create) the pinned birthday message with content + buttons."""
+) -> discord.Message | discord.PartialMessage | None:
+    """
+    Update (or create) the pinned birthday message with content + buttons.
+
+    Returns the sent/edited Message, or a PartialMessage when the content was
+    unchanged and no request was made. A `manual` refresh always goes to
+    Discord, so a deleted list is sent again and an unpinned one re-pinned.
+    """
 
     # Fetch guild config from the db instance
-    guild_config = await db.get_guild_config(str(guild.id))
+    guild_config = await db.get_guild_config(guild.id)
     if not guild_config:
         logger.warning(f"No guild config for {guild.name}, skipping pinned message update.")
         return None
 
-    try:
-        channel_id = int(guild_config["channel_id"])
-    except (TypeError, ValueError):
-        logger.error(f"Invalid channel ID for {guild.name}: {guild_config.get('channel_id')}")
+    channel = await resolver.resolve_channel(guild, guild_config["channel_id"])
+    if channel is None:
         return None
-
-    channel = guild.get_channel(channel_id) or await guild.fetch_channel(channel_id)
     perms = channel.permissions_for(guild.me)
     if not perms.send_messages:
         logger.error(f"Cannot send messages in channel {channel.name} ({channel.id})")
         return None
 
     check_hour = guild_config.get("check_hour", 9)
-    birthdays = await db.get_birthdays(str(guild.id))
-    today = dt.datetime.now(dt.timezone.utc)
-
-    # ---------------- Fetch existing pinned message ----------------
-    pinned_msg = None
-    async with db.db.execute(
-        "SELECT value FROM config WHERE key=?", (f"pinned_birthday_msg_{str(guild.id)}",)
-    ) as cursor:
-        result = await cursor.fetchone()
-    if result:
-        try:
-            pinned_msg_id = int(result[0])
-            pinned_msg = await channel.fetch_message(pinned_msg_id)
-        except discord.NotFound:
-            pinned_msg = None
+    pages = await get_birthday_pages(guild, db)
+
+    # ---------------- Existing pinned message handle ----------------
+    # The stored ID is read once per process; edits go through a partial message so
+    # no fetch is needed. A handle for another channel means /setup moved the list.
+    id_key = f"pinned_birthday_msg_{guild.id}"
+    hash_key = f"pinned_birthday_hash_{guild.id}"
+    if guild.id not in _pinned_handles:
+        stored_id = await db.get_config_value(id_key)
+        if stored_id:
+            _pinned_handles[guild.id] = channel.get_partial_message(int(stored_id))
+            _pinned_hashes[guild.id] = await db.get_config_value(hash_key) or None
+    pinned_msg = _pinned_handles.get(guild.id)
+    if pinned_msg and pinned_msg.channel.id != channel.id:
+        pinned_msg = None
 
     # ---------------- Build content ----------------
-    if not birthdays:
+    if not pages:
         content = "🎂 BIRTHDAY LIST 🎂\n------------------------\n```yaml\nNo birthdays found!\n```"
-        view_to_use = None
     else:
-        # Safe upcoming_sort_key that handles Feb 29
-        def upcoming_sort_key(b):
-            month, day = map(int, b[1].split("-"))
-            year = today.year
-
-            # Adjust Feb 29 on non-leap years
-            if month == 2 and day == 29:
-                is_leap = (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0))
-                if not is_leap:
-                    day = 28
-
-            try:
-                current_year_birthday = dt.datetime(year, month, day, tzinfo=dt.timezone.utc)
-            except ValueError:
-                current_year_birthday = dt.datetime(year + 1, month, day, tzinfo=dt.timezone.utc)
-
-            # If birthday already passed this year (and today isn’t their birthday), use next year
-            if current_year_birthday < today and not is_birthday_on_date(b[1], today):
-                next_year_birthday = dt.datetime(year + 1, month, day, tzinfo=dt.timezone.utc)
-                return (next_year_birthday - today).total_seconds()
+        content, _ = await get_rendered_page(guild, db, 0, check_hour)
+    view_to_use = birthday_page_view(guild.id, 0, len(pages))
 
-            return (current_year_birthday - today).total_seconds()
-
-        sorted_birthdays = sorted(birthdays, key=upcoming_sort_key)
-        pages = [sorted_birthdays[i:i + MAX_PINNED_ENTRIES] for i in range(0, len(sorted_birthdays), MAX_PINNED_ENTRIES)]
-        view = BirthdayPages(pages, guild, check_hour)
-        view.current = 0
-
-        page_content = []
-        for uid, bday in pages[0]:
-            member = guild.get_member(int(uid))
-            name = member.display_name if member else f"<@{uid}>"
-            prefix = "・" + (CONFETTI_ICON if is_birthday_on_date(bday, today) else "")
-            page_content.append(f"{prefix}{name} - {format_birthday_display(bday)}")
-
-        content = "🎂 BIRTHDAY LIST 🎂\n------------------------\n" + "\n".join(page_content)
-        content += "\n\n-# 💡 Tip: Use /setbirthday to add your own special day!\n"
-        content += f"-# ⏰ Bot checks birthdays daily at {check_hour}:00 UTC"
-        if len(pages) > 1:
-            content += f"\n\nPage 1/{len(pages)}"
-
-        view_to_use = view
+    # ---------------- Skip unchanged content ----------------
+    # The hash covers the text and the button layout
+    content_hash = hashlib.sha256(f"{content}\npages={len(pages)}".encode()).hexdigest()
+    if pinned_msg and not manual and _pinned_hashes.get(guild.id) == content_hash:
+        pinned_edit_stats["skipped"] += 1
+        logger.debug(f"Pinned message unchanged in {guild.name}, skipping edit.")
+        return pinned_msg
 
     # ---------------- Edit or Send ----------------
+    previous_id = pinned_msg.id if pinned_msg else None
     try:
         if pinned_msg:
-            await pinned_msg.edit(content=content, view=view_to_use)
-        else:
-            pinned_msg = await channel.send(content=content, view=view_to_use)
+            try:
+                pinned_msg = await pinned_msg.edit(
+                    content=content, view=view_to_use, allowed_mentions=discord.AllowedMentions.none()
+                )
+                pinned_edit_stats["edited"] += 1
+            except discord.NotFound:
+                logger.info(f"Pinned birthday message in {guild.name} was deleted, sending a new one.")
+                pinned_msg = None
+        if not pinned_msg:
+            # Names without a snapshot render as mentions; nobody should be pinged by the list
+            pinned_msg = await channel.send(
+                content=content, view=view_to_use, allowed_mentions=discord.AllowedMentions.none()
+            )
             if perms.manage_messages:
                 try:
                     await pinned_msg.pin()
                 except Exception:
                     pass
+        elif manual and not pinned_msg.pinned and perms.manage_messages:
+            try:
+                await pinned_msg.pin()
+                logger.info(f"Re-pinned birthday message in {guild.name}.")
+            except Exception as e:
+                logger.warning(f"Cannot pin birthday message in {guild.name}: {e}")
     except Exception as e:
         logger.error(f"Failed to update pinned message in {guild.name}: {e}")
-        pinned_msg = None
+        return None
 
-    # ---------------- Save pinned message ID ----------------
-    if pinned_msg:
-        await db.db.execute(
-            "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
-            (f"pinned_birthday_msg_{guild.id}", str(pinned_msg.id))
-        )
-        await db.db.commit()
+    # ---------------- Save pinned message handle and content hash ----------------
+    _pinned_handles[guild.id] = channel.get_partial_message(pinned_msg.id)
+    if pinned_msg.id != previous_id:
+        await db.set_config_value(id_key, str(pinned_msg.id))
+    if _pinned_hashes.get(guild.id) != content_hash:
+        # Only saves an edit next time if lost, so there's no need to wait for the commit
+        await db.set_config_value(hash_key, content_hash, durable=False)
+        _pinned_hashes[guild.id] = content_hash
 
     return pinned_msg
 
 
+# ---------------- Debounced Pinned Refresh ----------------
+class PinnedRefreshQueue:
+    """
+    Coalesces pinned message refreshes per guild.
+
+    `mark_dirty` returns immediately; the guild's pinned message is rebuilt
+    once the window has passed, however many changes arrived in between.
+    Refreshes that can't wait go through `refresh_now`; either way, refreshes
+    for the same guild never run concurrently (so two can't both send a new list).
+    """
+
+    def __init__(self, bot, window_seconds: float):
+        self.bot = bot
+        self.window_seconds = window_seconds
+        self._pending: dict[int, asyncio.Task] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+        self.requested = 0
+        self.flushed = 0
+
+    def mark_dirty(self, guild: discord.Guild):
+        """Schedules a refresh of the guild's pinned message, coalescing with any pending one."""
+        self.requested += 1
+        if guild.id not in self._pending:
+            self._pending[guild.id] = asyncio.create_task(self._flush_later(guild.id))
+
+    async def refresh_now(self, guild: discord.Guild, manual: bool = False):
+        """Refreshes the guild's pinned message right away; returns it like update_pinned_birthday_message."""
+        async with self._locks.setdefault(guild.id, asyncio.Lock()):
+            return await update_pinned_birthday_message(guild, db=self.bot.db, manual=manual)
+
+    async def _flush_later(self, guild_id: int):
+        try:
+            await asyncio.sleep(self.window_seconds)
+        finally:
+            # Changes from here on need a fresh refresh, so open a new window for them
+            self._pending.pop(guild_id, None)
+
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            return
+
+        try:
+            await self.refresh_now(guild)
+            self.flushed += 1
+        except Exception as e:
+            logger.error(f"Failed debounced pinned refresh in {guild.name}: {e}", exc_info=True)
+
+
 # ---------------- Ensure Setup ----------------
 async def ensure_setup(interaction: discord.Interaction, db=None) -> bool:
     """